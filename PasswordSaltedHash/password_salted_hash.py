@@ -1,35 +1,305 @@
+_bulk_hasher = None
+
+def _bulk_worker_init(config):
+    """Bulk worker process initializer: one PasswordSaltedHash per process."""
+    global _bulk_hasher
+    _bulk_hasher = PasswordSaltedHash(**config)
+
+def _bulk_worker_chunk(method, chunk, *args):
+    return getattr(_bulk_hasher, method)(chunk, *args)
+
 class PasswordSaltedHash():
-    def __init__(self,salt_byte_length=32,algorithm='sha256'):
+    """Salted password hashes. Algorithms: md5, sha1, sha224, sha256, sha384, sha512
+    (one digest of salt + password) and the key-stretching KDFs pbkdf2_sha256,
+    pbkdf2_sha512 and scrypt.
+
+    Hashes are self-describing: '$algorithm$v=1,params$salt$hexdigest', e.g.
+    '$scrypt$v=1,n=16384,r=8,p=1$<salt>$<hash>', so a store can mix algorithms
+    and costs. validate() also reads the older layouts, hexdigest + salt and
+    'params$' + hexdigest + salt, as made with "legacy_algorithm" (default:
+    "algorithm") and "salt_byte_length". legacy_format=True makes create()
+    write those layouts. "on_upgrade(old, new)" is called after a successful
+    validate() of a hash that needs_upgrade(), with a fresh hash to store."""
+    KDFS = ('pbkdf2_sha256','pbkdf2_sha512','scrypt')
+    DIGESTS = ('md5','sha1','sha224','sha256','sha384','sha512')
+    SCHEMES = {'md5': 'digest_hash','sha1': 'digest_hash','sha224': 'digest_hash','sha256': 'digest_hash',
+               'sha384': 'digest_hash','sha512': 'digest_hash','pbkdf2_sha256': 'pbkdf2_hash',
+               'pbkdf2_sha512': 'pbkdf2_hash','scrypt': 'scrypt_hash'} # Algorithm -> method(algorithm,salt,password,params)
+    VERSION = 1 # Format version, the 'v' parameter
+    MAX_MEMORY = 1 << 30 # Largest scrypt memory (128 * n * r bytes) accepted from a stored hash
+    def __init__(self,salt_byte_length=32,algorithm='sha256',iterations=600000,scrypt_n=16384,scrypt_r=8,scrypt_p=1,
+                 legacy_algorithm=None,legacy_format=False,on_upgrade=None):
         import hashlib
-        from random import randint
-        from binascii import hexlify
+        import hmac
+        from os import urandom, cpu_count
+        from time import perf_counter
+        from threading import Thread
+        from os import fsync, path, remove, replace
         self.hashlib = hashlib
-        self.randint = randint
-        self.hexlify = hexlify
+        self.hmac = hmac
+        self.urandom = urandom
+        self.cpu_count = cpu_count
+        self.perf_counter = perf_counter
+        self.Thread = Thread
+        self.fsync = fsync
+        self.path = path
+        self.remove = remove
+        self.replace = replace
         self.salt_length = salt_byte_length
         self.algorithm = str(algorithm).lower()
+        self.iterations = iterations # pbkdf2_*
+        self.scrypt_n = scrypt_n # CPU/memory cost, a power of 2; memory is 128 * n * r bytes
+        self.scrypt_r = scrypt_r # Block size
+        self.scrypt_p = scrypt_p # Parallelization, multiplies CPU cost but not memory
+        self.legacy_algorithm = str(legacy_algorithm or algorithm).lower()
+        self.legacy_format = legacy_format
+        self.on_upgrade = on_upgrade
+    def config(self):
+        """Constructor arguments reproducing this instance, e.g. in worker processes (without on_upgrade)."""
+        return {'salt_byte_length': self.salt_length,'algorithm': self.algorithm,'iterations': self.iterations,
+                'scrypt_n': self.scrypt_n,'scrypt_r': self.scrypt_r,'scrypt_p': self.scrypt_p,
+                'legacy_algorithm': self.legacy_algorithm,'legacy_format': self.legacy_format}
+    def params(self):
+        """Cost parameters for new hashes."""
+        if self.algorithm == 'scrypt': return {'n': self.scrypt_n,'r': self.scrypt_r,'p': self.scrypt_p}
+        if self.algorithm in self.KDFS: return {'i': self.iterations}
+        return {}
+    def digest_hash(self,algorithm,salt,password,params):
+        return getattr(self.hashlib,algorithm)((salt + password).encode()).hexdigest()
+    def pbkdf2_hash(self,algorithm,salt,password,params):
+        return self.hashlib.pbkdf2_hmac(algorithm[7:],password.encode(),salt.encode(),params['i'],32).hex()
+    def scrypt_hash(self,algorithm,salt,password,params):
+        n, r, p = params['n'], params['r'], params['p']
+        return self.hashlib.scrypt(password.encode(),salt=salt.encode(),n=n,r=r,p=p,maxmem=129*n*r+1024*r*p+1048576,dklen=32).hex()
+    def compute(self,algorithm,salt,password,params):
+        """Hexdigest of password with salt and params, dispatched through SCHEMES.
+        A wrapped hash ('inner=sha256.<salt>', see rehash()) first takes the inner digest."""
+        if 'inner' in params:
+            inner_algorithm, inner_salt = params['inner'].split('.',1)
+            password = self.digest_hash(inner_algorithm,inner_salt,password,{})
+        return getattr(self,self.SCHEMES[algorithm])(algorithm,salt,password,params)
+    def encode(self,algorithm,params,salt,digest):
+        return '$'+algorithm+'$'+','.join(['v='+str(self.VERSION)]+[k+'='+str(v) for k, v in params.items()])+'$'+salt+'$'+digest
+    def parse(self,hashed_password):
+        """Returns (algorithm, params, salt, hexdigest) of a stored hash in any supported layout, or None."""
+        try:
+            if hashed_password.startswith('$'):
+                empty, algorithm, params, salt, digest = hashed_password.split('$')
+                params = dict([kv.split('=',1) for kv in params.split(',')])
+                if int(params.pop('v',0)) not in range(1,self.VERSION+1): return None
+            else: # Layouts without algorithm: hexdigest + salt, 'params$' + hexdigest + salt
+                if len(hashed_password) <= self.salt_length: return None
+                algorithm = self.legacy_algorithm
+                digest = hashed_password[0:len(hashed_password)-self.salt_length]
+                salt = hashed_password[len(hashed_password)-self.salt_length:]
+                params = {}
+                if '$' in digest:
+                    params, digest = digest.split('$',1)
+                    params = dict([kv.split('=',1) for kv in params.split(',')])
+            params = dict([(k,v if k == 'inner' else int(v)) for k, v in params.items()])
+        except ValueError:
+            return None
+        if algorithm not in self.SCHEMES: return None
+        if algorithm == 'scrypt':
+            n, r, p = params.get('n',0), params.get('r',0), params.get('p',0)
+            # n a power of 2 below 2**(16*r), r*p < 2**30, memory within MAX_MEMORY
+            if not (1 < n < 2**min(16*r,64) and n & (n-1) == 0 and 1 <= r and 1 <= p and r*p < 2**30 and 128*n*r <= self.MAX_MEMORY): return None
+        if algorithm in self.KDFS[:2] and not 1 <= params.get('i',0) < 2**31: return None
+        if 'inner' in params:
+            inner = params['inner'].split('.')
+            if len(inner) != 2 or inner[0] not in self.DIGESTS: return None
+        return algorithm, params, salt, digest
+    def needs_upgrade(self,hashed_password):
+        """True when a valid stored hash differs from what create() makes now: algorithm, cost, salt length or layout."""
+        parsed = self.parse(hashed_password)
+        if parsed is None: return False
+        algorithm, params, salt, digest = parsed
+        return (algorithm != self.algorithm or params != self.params() or len(salt) != self.salt_length
+                or hashed_password.startswith('$') == self.legacy_format)
+    def calibrate(self,target_ms=50,concurrency=1,max_memory=64*1024*1024):
+        """Benchmarks this host and sets the KDF cost so one validation takes about
+        "target_ms" while "concurrency" validations run at the same time (the KDFs
+        release the GIL, so they are timed in parallel threads). For scrypt the
+        memory of all concurrent validations stays below "max_memory"; time beyond
+        that is bought with p. Returns the parameters."""
+        if self.algorithm not in self.KDFS:
+            raise ValueError('calibrate() needs one of '+', '.join(self.KDFS))
+        target = target_ms/1000.0
+        salt = '0'*self.salt_length
+        def timed(params):
+            threads = [self.Thread(target=self.compute,args=(self.algorithm,salt,'calibration',params)) for x in range(max(1,concurrency))]
+            start = self.perf_counter()
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            return self.perf_counter() - start
+        if self.algorithm == 'scrypt':
+            r = self.scrypt_r
+            n = 1024
+            elapsed = timed({'n': n,'r': r,'p': 1})
+            while elapsed*2 <= target and 128*2*n*r*max(1,concurrency) <= max_memory and 128*2*n*r <= self.MAX_MEMORY:
+                n *= 2
+                elapsed = timed({'n': n,'r': r,'p': 1})
+            self.scrypt_n = n
+            self.scrypt_p = max(1,int(target/elapsed))
+        else:
+            iterations = 1000
+            elapsed = timed({'i': iterations})
+            while elapsed < 0.01: # Long enough to measure
+                iterations *= 4
+                elapsed = timed({'i': iterations})
+            self.iterations = max(1000,int(iterations*target/elapsed))
+        return self.params()
     def create(self,password):
-        salt = str(self.hexlify(''.join([chr(self.randint(32,126)) for x in range(0,self.salt_length//2)]).encode()),'ascii')
-        if self.algorithm == 'md5'   : return self.hashlib.md5(salt.encode() + password.encode()).hexdigest() + salt
-        if self.algorithm == 'sha1'  : return self.hashlib.sha1(salt.encode() + password.encode()).hexdigest() + salt
-        if self.algorithm == 'sha224': return self.hashlib.sha224(salt.encode() + password.encode()).hexdigest() + salt
-        if self.algorithm == 'sha256': return self.hashlib.sha256(salt.encode() + password.encode()).hexdigest() + salt
-        if self.algorithm == 'sha384': return self.hashlib.sha384(salt.encode() + password.encode()).hexdigest() + salt
-        if self.algorithm == 'sha512': return self.hashlib.sha512(salt.encode() + password.encode()).hexdigest() + salt
+        if self.algorithm not in self.SCHEMES: return None
+        salt = self.urandom(self.salt_length//2).hex()
+        params = self.params()
+        digest = self.compute(self.algorithm,salt,password,params)
+        if not self.legacy_format: return self.encode(self.algorithm,params,salt,digest)
+        if params: return ','.join([k+'='+str(v) for k, v in params.items()]) + '$' + digest + salt
+        return digest + salt
+    def __check(self,hashed_password,user_password):
+        parsed = self.parse(hashed_password)
+        if parsed is None: return False
+        algorithm, params, salt, digest = parsed
+        # Bytes: compare_digest() raises TypeError for non-ASCII str
+        return self.hmac.compare_digest(digest.encode('utf-8','surrogatepass'),self.compute(algorithm,salt,user_password,params).encode())
     def validate(self,hashed_password,user_password):
-        password = hashed_password[0:len(hashed_password)-self.salt_length]
-        salt = hashed_password[len(hashed_password)-self.salt_length:]
-        if self.algorithm == 'md5'   : return password == self.hashlib.md5(salt.encode() + user_password.encode()).hexdigest()
-        if self.algorithm == 'sha1'  : return password == self.hashlib.sha1(salt.encode() + user_password.encode()).hexdigest()
-        if self.algorithm == 'sha224': return password == self.hashlib.sha224(salt.encode() + user_password.encode()).hexdigest()
-        if self.algorithm == 'sha256': return password == self.hashlib.sha256(salt.encode() + user_password.encode()).hexdigest()
-        if self.algorithm == 'sha384': return password == self.hashlib.sha384(salt.encode() + user_password.encode()).hexdigest()
-        if self.algorithm == 'sha512': return password == self.hashlib.sha512(salt.encode() + user_password.encode()).hexdigest()
+        if self.on_upgrade is not None: return self.validate_and_upgrade(hashed_password,user_password)[0]
+        return self.__check(hashed_password,user_password)
+    def validate_and_upgrade(self,hashed_password,user_password):
+        """Returns (valid, new_hash): new_hash is a fresh create() to store when the
+        password is valid and the stored hash needs_upgrade(), else None. The same
+        new_hash is passed to on_upgrade(old, new) when that is set."""
+        if not self.__check(hashed_password,user_password): return False, None
+        if not self.needs_upgrade(hashed_password): return True, None
+        new_hash = self.create(user_password)
+        if self.on_upgrade is not None: self.on_upgrade(hashed_password,new_hash)
+        return True, new_hash
+    def rehash(self,hashed_password,mode='rewrap'):
+        """Converts a stored hash without the password. 'rewrap' writes it in the
+        self-describing layout. 'wrap' (for a KDF "algorithm") also stretches a plain
+        digest hash: the new hash is the KDF of the old hexdigest, with the old
+        algorithm and salt kept as 'inner', so it validates the same password.
+        Unparseable hashes are returned unchanged."""
+        parsed = self.parse(hashed_password)
+        if parsed is None: return hashed_password
+        algorithm, params, salt, digest = parsed
+        if mode == 'wrap' and algorithm in self.DIGESTS:
+            inner = algorithm + '.' + salt
+            algorithm, params, salt = self.algorithm, self.params(), self.urandom(self.salt_length//2).hex()
+            digest = self.compute(algorithm,salt,digest,params)
+            params['inner'] = inner
+        return self.encode(algorithm,params,salt,digest)
+    def create_chunk(self,passwords):
+        return [self.create(password) for password in passwords]
+    def validate_chunk(self,pairs):
+        return [self.validate(hashed_password,user_password) for hashed_password, user_password in pairs]
+    def rehash_chunk(self,lines,mode,sep,field):
+        """Rehashes field "field" of each (line, offset) and returns (new line, offset, copied),
+        as bytes; copied is true for lines that are not UTF-8 or have no parseable hash,
+        which are left as they are."""
+        out = []
+        for line, offset in lines:
+            body = line.rstrip(b'\r\n')
+            try: fields = body.decode('utf-8').split(sep)
+            except UnicodeDecodeError: fields = []
+            copied = len(fields) <= field or self.parse(fields[field]) is None
+            if not copied:
+                fields[field] = self.rehash(fields[field],mode)
+                line = sep.join(fields).encode('utf-8') + line[len(body):]
+            out.append((line,offset,copied))
+        return out
+    def __bulk(self,method,items,workers,processes,chunk_size,args=()):
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        from collections import deque
+        from itertools import islice
+        workers = workers or self.cpu_count() or 1
+        chunk_size = chunk_size or (8 if self.algorithm in self.KDFS else 1024)
+        if processes:
+            executor = ProcessPoolExecutor(workers,initializer=_bulk_worker_init,initargs=(self.config(),))
+            submit = lambda chunk: executor.submit(_bulk_worker_chunk,method,chunk,*args)
+        else:
+            executor = ThreadPoolExecutor(workers)
+            submit = lambda chunk: executor.submit(getattr(self,method),chunk,*args)
+        items = iter(items)
+        with executor:
+            in_flight = deque()
+            while True:
+                chunk = list(islice(items,chunk_size))
+                if not chunk: break
+                in_flight.append(submit(chunk))
+                if len(in_flight) >= 2*workers:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+    def create_many(self,passwords,workers=None,processes=False,chunk_size=None):
+        """Generator of create() results for an iterable of passwords, in input order.
+        Chunks of "chunk_size" passwords are hashed by "workers" threads (the KDFs
+        release the GIL) or, with processes=True, worker processes (for the plain
+        digests, which hold the GIL on short input). At most two chunks per worker
+        are in flight, so memory stays bounded for any number of records."""
+        return self.__bulk('create_chunk',passwords,workers,processes,chunk_size)
+    def validate_many(self,pairs,workers=None,processes=False,chunk_size=None):
+        """Generator of validate() results for an iterable of (hashed_password, user_password) pairs, in input order.
+        With threads, on_upgrade is called from the pool threads, concurrently, so
+        it must be thread-safe. Worker processes cannot call back into this
+        process, so on_upgrade together with processes=True is rejected."""
+        if processes and self.on_upgrade is not None:
+            raise ValueError('on_upgrade is not called from worker processes, use threads')
+        return self.__bulk('validate_chunk',pairs,workers,processes,chunk_size)
+    def rehash_file(self,source,target,mode='rewrap',sep=':',field=1,workers=None,processes=False,chunk_size=None,checkpoint_lines=100000):
+        """Streams credential file "source" to "target", passing field "field" of each
+        "sep"-separated line through rehash(); other lines are copied. Lines go
+        through the bulk pool in order, so memory is bounded for any file size.
+        Every "checkpoint_lines" lines the target is synced and the byte offsets
+        are saved to target + '.checkpoint'; after an interruption the same call
+        resumes there. Returns the number of lines written by this call; of those,
+        self.copied_lines had no hash parseable with "legacy_algorithm" and
+        "salt_byte_length" and were copied unchanged."""
+        if mode == 'wrap' and self.algorithm not in self.KDFS:
+            raise ValueError("mode 'wrap' needs one of "+', '.join(self.KDFS))
+        if mode == 'wrap' and self.legacy_algorithm not in self.DIGESTS:
+            # Bare hexdigest + salt lines would all fail to parse and be copied
+            raise ValueError("mode 'wrap' needs legacy_algorithm set to one of "+', '.join(self.DIGESTS))
+        checkpoint = target + '.checkpoint'
+        source_offset = target_offset = 0
+        if self.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                source_offset, target_offset = [int(x) for x in file.read().split()]
+        def save(offset):
+            out.flush()
+            self.fsync(out.fileno())
+            with open(checkpoint+'.tmp','w') as file:
+                file.write('%d %d' % (offset,out.tell()))
+            self.replace(checkpoint+'.tmp',checkpoint)
+        with open(source,'rb') as src, open(target,'r+b' if target_offset else 'wb') as out:
+            out.truncate(target_offset)
+            out.seek(target_offset)
+            src.seek(source_offset)
+            def lines():
+                offset = source_offset
+                for line in iter(src.readline,b''):
+                    offset += len(line)
+                    yield line, offset
+            count = 0
+            self.copied_lines = 0
+            for line, offset, copied in self.__bulk('rehash_chunk',lines(),workers,processes,chunk_size or 1024,(mode,sep,field)):
+                out.write(line)
+                count += 1
+                self.copied_lines += copied
+                if count % checkpoint_lines == 0:
+                    save(offset)
+        if self.path.exists(checkpoint):
+            self.remove(checkpoint)
+        return count
 
 #---------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
     
     pw = PasswordSaltedHash()
+    if len(__import__('sys').argv) > 1: # e.g. scrypt or pbkdf2_sha256
+        pw = PasswordSaltedHash(algorithm=__import__('sys').argv[1])
+        print('calibrated',pw.calibrate(target_ms=50))
     
     mypass = 'TestOfThisClass'
     print('mypass =',mypass)
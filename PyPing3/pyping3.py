@@ -4,13 +4,661 @@
 # Created:      23-05-2016
 # Revision:     03-06-2016
 #-------------------------------------------------------------------------------
+# Requirements:
+# Python 3.7+ (time.perf_counter_ns(), time.time_ns(), asyncio.get_running_loop())
+# numpy, optional: ResultBatch.to_numpy(), RTTHistory queries
+#-------------------------------------------------------------------------------
+from collections.abc import Mapping
+
+class DNSCache():
+    """
+    Forward and reverse resolver cache shared by all PyPing3 lookups.
+
+    Holds at most "max_entries" names per direction (least recently used are
+    evicted first). Answers expire after "ttl" seconds; failed lookups are
+    cached as negative entries for "negative_ttl" seconds and re-raise the
+    original socket error. Thread safe, so hosts can be resolved in parallel.
+    """
+
+    import socket
+    from collections import OrderedDict
+    from threading import Lock
+    from time import monotonic
+
+    def __init__(self,max_entries=65536,ttl=300,negative_ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.forward = self.OrderedDict()
+        self.reverse = self.OrderedDict()
+        self.lock = self.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __lookup(self, table, key, resolver):
+        now = self.monotonic()
+        with self.lock:
+            entry = table.get(key)
+            if entry is not None and entry[0] > now:
+                table.move_to_end(key)
+                self.hits += 1
+                expires, value, exc = entry
+                if exc is None:
+                    return value
+                raise exc[0](*exc[1])
+            self.misses += 1
+        try:
+            value = resolver(key)
+        except self.socket.error as e:
+            entry = (now + self.negative_ttl, None, (type(e), e.args))
+        else:
+            entry = (now + self.ttl, value, None)
+        with self.lock:
+            table[key] = entry
+            table.move_to_end(key)
+            while len(table) > self.max_entries:
+                table.popitem(last=False)
+        if entry[2] is not None:
+            raise entry[2][0](*entry[2][1])
+        return value
+
+    def gethostbyname(self, host):
+        """Cached socket.gethostbyname()."""
+        return self.__lookup(self.forward, host, self.socket.gethostbyname)
+
+    def gethostbyaddr(self, ip):
+        """Cached socket.gethostbyaddr()."""
+        return self.__lookup(self.reverse, ip, self.socket.gethostbyaddr)
+
+    def clear(self):
+        with self.lock:
+            self.forward.clear()
+            self.reverse.clear()
+
+class RTTEstimator():
+    """
+    Per host smoothed RTT and RTT variance (RFC 6298) used to set tight probe
+    deadlines. Hosts that were never measured use their /24 subnet's estimate
+    as prior, and fall back to "max_timeout" when neither exists. Each loss
+    doubles the host's deadline (back-off) until the next reply.
+    Deadlines are clamped to [min_timeout, max_timeout] seconds.
+    """
+
+    def __init__(self,min_timeout=0.2,max_timeout=4):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.hosts = {} # ip -> [srtt, rttvar, backoff]
+        self.subnets = {} # 'a.b.c' -> [srtt, rttvar, backoff]
+
+    def __update(self, table, key, rtt):
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [rtt, rtt / 2, 1]
+        else:
+            entry[1] = 0.75 * entry[1] + 0.25 * abs(entry[0] - rtt)
+            entry[0] = 0.875 * entry[0] + 0.125 * rtt
+            entry[2] = 1
+
+    def observe(self, ip, rtt):
+        """Feeds a measured round trip time (seconds) for "ip"."""
+        self.__update(self.hosts, ip, rtt)
+        self.__update(self.subnets, ip.rpartition('.')[0], rtt)
+
+    def lost(self, ip):
+        """Records a probe to "ip" that got no reply before its deadline."""
+        entry = self.hosts.get(ip)
+        if entry is not None:
+            entry[2] = min(entry[2] * 2, 64)
+
+    def timeout(self, ip):
+        """Returns the probe deadline in seconds for "ip"."""
+        entry = self.hosts.get(ip) or self.subnets.get(ip.rpartition('.')[0])
+        if entry is None:
+            return self.max_timeout
+        srtt, rttvar, backoff = entry
+        return min(max((srtt + 4 * rttvar) * backoff, self.min_timeout), self.max_timeout)
+
+class P2Quantile():
+    """
+    Streaming estimate of the "p" quantile (0 < p < 1) with the P-square
+    algorithm (Jain & Chlamtac, 1985): five markers whose heights are adjusted
+    with piecewise parabolic interpolation. Constant memory, O(1) per sample.
+    """
+
+    def __init__(self,p):
+        self.p = p
+        self.n = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5]
+        self.increments = [0, p/2, p, (1 + p)/2, 1]
+
+    def add(self, x):
+        q = self.heights
+        self.n += 1
+        if self.n <= 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k+1]:
+                k += 1
+        for i in range(k+1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i+1] - n[i] > 1) or (d <= -1 and n[i-1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                h = q[i] + d / (n[i+1] - n[i-1]) * ((n[i] - n[i-1] + d) * (q[i+1] - q[i]) / (n[i+1] - n[i])
+                                                  + (n[i+1] - n[i] - d) * (q[i] - q[i-1]) / (n[i] - n[i-1]))
+                if not q[i-1] < h < q[i+1]: # Parabolic step overshoots, use linear
+                    h = q[i] + d * (q[i+d] - q[i]) / (n[i+d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def value(self):
+        """Current estimate, None before the first sample."""
+        if self.n == 0:
+            return None
+        if self.n <= 5:
+            return self.heights[round((self.n - 1) * self.p)]
+        return self.heights[2]
+
+class RollingStats():
+    """
+    Constant memory statistics for one monitored host: count, min, max and
+    mean RTT, p50/p95/p99 from P-square sketches, RFC 3550 interarrival
+    jitter, and loss over the last "window" probes (a ring of lost flags).
+    RTTs are in ms, None for a lost probe.
+    """
+
+    def __init__(self,window=100):
+        self.sent = 0
+        self.received = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.jitter = 0.0
+        self.last_rtt = None
+        self.quantiles = {50: P2Quantile(0.50), 95: P2Quantile(0.95), 99: P2Quantile(0.99)}
+        self.window = bytearray(max(window, 1))
+        self.window_pos = 0
+        self.window_lost = 0
+
+    def add(self, rtt):
+        self.sent += 1
+        lost = rtt is None
+        self.window_lost += lost - self.window[self.window_pos]
+        self.window[self.window_pos] = lost
+        self.window_pos = (self.window_pos + 1) % len(self.window)
+        if lost:
+            return
+        self.received += 1
+        self.min = rtt if self.min is None else min(self.min, rtt)
+        self.max = rtt if self.max is None else max(self.max, rtt)
+        self.mean += (rtt - self.mean) / self.received
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        for sketch in self.quantiles.values():
+            sketch.add(rtt)
+
+    def percentile(self, p):
+        """Estimated p50, p95 or p99 RTT in ms."""
+        return self.quantiles[p].value()
+
+    def loss(self):
+        """Loss in percent over the last "window" probes (or fewer, early on)."""
+        probes = min(self.sent, len(self.window))
+        return self.window_lost * 100 / probes if probes else 0.0
+
+    def snapshot(self):
+        return {'sent': self.sent, 'received': self.received, 'min_ms': self.min, 'max_ms': self.max,
+                'average_ms': self.mean if self.received else None, 'jitter_ms': self.jitter,
+                'p50_ms': self.percentile(50), 'p95_ms': self.percentile(95), 'p99_ms': self.percentile(99),
+                'window_losspercent': self.loss()}
+
+class PingResult(Mapping):
+    """
+    Result of pinging one host. Compact (__slots__, no per instance dict) but
+    read and written like the result dict of earlier versions:
+
+    >>> res['ip'], res.ip, dict(res), res.keys()
+
+    It is a Mapping, not a dict: code that needs a real dict (json.dumps(),
+    isinstance(res, dict)) uses res.to_dict(); res.jsonl() gives the JSON line.
+    """
+
+    KEYS = ('host', 'ip', 'size', 'ttl', 'sent', 'recieved', 'lost', 'min_ms', 'max_ms', 'average_ms', 'losspercent')
+    JSONL_TEMPLATE = '{{' + ', '.join('"' + key + '": {}' for key in KEYS) + '}}\n'
+    __slots__ = KEYS
+
+    def __init__(self,host,ip,size,ttl,sent,recieved,lost,min_ms,max_ms,average_ms,losspercent):
+        self.host = host
+        self.ip = ip
+        self.size = size
+        self.ttl = ttl
+        self.sent = sent
+        self.recieved = recieved
+        self.lost = lost
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.average_ms = average_ms
+        self.losspercent = losspercent
+
+    @property
+    def received(self):
+        return self.recieved
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def to_dict(self):
+        """Returns the result as a plain dict, as ping() returned before."""
+        return {key: getattr(self, key) for key in self.KEYS}
+
+    def jsonl(self):
+        """Returns the result as one JSON line, like ResultBatch.write_jsonl()."""
+        from json import dumps
+        return self.JSONL_TEMPLATE.format(dumps(self.host), dumps(self.ip), self.size, self.ttl, self.sent, self.recieved,
+                                          self.lost, self.min_ms, self.max_ms, self.average_ms, self.losspercent)
+
+class ResultBatch():
+    """
+    Columnar results of a multi-host run: one array per numeric column and
+    one list per string column instead of a dict per host. Indexing and
+    iteration give PingResult rows for existing callers. The write_csv(),
+    write_jsonl() and to_numpy() exports read the columns directly, without
+    building an object per row. With "precise" the ms columns hold fractional
+    milliseconds (typecode 'd').
+    """
+
+    from array import array
+    TYPECODES = {'size': 'l', 'ttl': 'l', 'sent': 'l', 'recieved': 'l', 'lost': 'l',
+                 'min_ms': 'l', 'max_ms': 'l', 'average_ms': 'l', 'losspercent': 'd'}
+
+    def __init__(self, precise=False):
+        self.columns = {}
+        for key in PingResult.KEYS:
+            typecode = self.TYPECODES.get(key)
+            if precise and key.endswith('_ms'):
+                typecode = 'd'
+            self.columns[key] = [] if typecode is None else self.array(typecode)
+        self.__appenders = [self.columns[key].append for key in PingResult.KEYS]
+
+    def __getstate__(self):
+        return self.columns
+
+    def __setstate__(self, columns):
+        self.columns = columns
+        self.__appenders = [self.columns[key].append for key in PingResult.KEYS]
+
+    def append(self, values):
+        """Appends one row given as values in PingResult.KEYS order."""
+        for append, value in zip(self.__appenders, values):
+            append(value)
+
+    def column(self, key):
+        """The list (host, ip) or array (numbers) holding column "key"."""
+        return self.columns[key]
+
+    def __len__(self):
+        return len(self.columns['host'])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return PingResult(*[self.columns[key][idx] for key in PingResult.KEYS])
+
+    def __iter__(self):
+        for values in zip(*[self.columns[key] for key in PingResult.KEYS]):
+            yield PingResult(*values)
+
+    def __repr__(self):
+        return 'ResultBatch(' + repr(list(self)) + ')'
+
+    def write_csv(self, file, header=True):
+        """Writes the batch as CSV to an open text file."""
+        import csv
+        writer = csv.writer(file)
+        if header:
+            writer.writerow(PingResult.KEYS)
+        writer.writerows(zip(*[self.columns[key] for key in PingResult.KEYS]))
+
+    def write_jsonl(self, file):
+        """Writes one JSON object per host to an open text file."""
+        from json import dumps
+        template = PingResult.JSONL_TEMPLATE
+        columns = [self.columns[key] if key not in ('host', 'ip') else map(dumps, self.columns[key]) for key in PingResult.KEYS]
+        file.writelines(template.format(*values) for values in zip(*columns))
+
+    def to_numpy(self):
+        """Returns {column: numpy array}. Numeric columns wrap the array buffers without copying. Needs numpy."""
+        import numpy
+        result = {}
+        for key, column in self.columns.items():
+            if isinstance(column, list):
+                result[key] = numpy.array(column)
+            else:
+                result[key] = numpy.frombuffer(column, dtype=column.typecode)
+        return result
+
+class RTTHistory():
+    """
+    Persistent RTT history: a fixed-size ring of (time, rtt_ms, ttl, lost)
+    records per host in a memory-mapped file. An append writes one record in
+    place, so the file never grows or gets rewritten; once a host's ring is
+    full its oldest records are overwritten. Queries are NumPy views and masks
+    over the mapping rather than Python objects per record (iter_records()
+    works without numpy). Set it as PyPing3.history to record every probe of
+    monitor() and ping_many(). One process writes a file; others may read it.
+
+    File layout, little endian: a 64 byte header (magic, capacity, max_hosts),
+    max_hosts directory slots (64 byte utf-8 host key, uint64 records
+    written), then one ring of "capacity" 16 byte records per slot (float64
+    unix time, float32 rtt_ms, NaN when lost, uint8 ttl, uint8 lost). New
+    files are created sparse, so disk is only used by rings that were written;
+    existing files keep their own sizes. Once all max_hosts slots are taken,
+    probes of further hosts are not recorded (append() returns False) and are
+    counted in self.dropped, so a sweep never fails on a full history.
+
+    >>> history = RTTHistory( 'rtt.db', capacity=86400, max_hosts=16384 )
+    >>> p.history = history
+    >>> for res in p.monitor(['8.8.8.8', '1.1.1.1'], interval=1.0): ...
+    >>> history.percentile('8.8.8.8', 95, minutes=60), history.loss('8.8.8.8', minutes=60)
+    """
+
+    import mmap, os
+    from struct import Struct
+    from time import time
+
+    MAGIC = b'PYRTTH01'
+    HEADER = Struct('<8sQQ') # magic, capacity, max_hosts
+    HEADER_SIZE = 64
+    SLOT = Struct('<64sQ') # host key, records written
+    COUNT = Struct('<Q')
+    RECORD = Struct('<dfBBxx')
+    DTYPE = {'names': ['time', 'rtt_ms', 'ttl', 'lost'], 'formats': ['<f8', '<f4', 'u1', 'u1'],
+             'offsets': [0, 8, 12, 13], 'itemsize': 16}
+
+    def __init__(self, path, capacity=86400, max_hosts=16384):
+        if not self.os.path.exists(path) or self.os.path.getsize(path) == 0:
+            with open(path, 'wb') as file:
+                file.write(self.HEADER.pack(self.MAGIC, capacity, max_hosts))
+                file.truncate(self.HEADER_SIZE + max_hosts * (self.SLOT.size + capacity * self.RECORD.size))
+        self.file = open(path, 'r+b')
+        self.map = self.mmap.mmap(self.file.fileno(), 0)
+        magic, self.capacity, self.max_hosts = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(path + ' is not an RTT history file')
+        self.data_offset = self.HEADER_SIZE + self.max_hosts * self.SLOT.size
+        self.slots = {}
+        self.dropped = 0 # Records not written: no free slot or host key too long
+        self.__scan()
+
+    def __scan(self):
+        """Adds directory slots claimed since the last scan (slots fill in order)."""
+        for slot in range(len(self.slots), self.max_hosts):
+            key = self.SLOT.unpack_from(self.map, self.HEADER_SIZE + slot * self.SLOT.size)[0].rstrip(b'\0')
+            if not key:
+                break
+            self.slots[key.decode()] = slot
+
+    def __slot(self, host, create=False):
+        """Returns the directory slot of "host", claiming a free one with "create", else None
+        (also when the directory is full or the key is longer than 64 bytes)."""
+        slot = self.slots.get(host)
+        if slot is None:
+            self.__scan()
+            slot = self.slots.get(host)
+            if slot is None and create:
+                slot = len(self.slots)
+                key = host.encode()
+                if slot >= self.max_hosts or len(key) > 64:
+                    return None
+                self.SLOT.pack_into(self.map, self.HEADER_SIZE + slot * self.SLOT.size, key, 0)
+                self.slots[host] = slot
+        return slot
+
+    def __count_offset(self, slot):
+        return self.HEADER_SIZE + slot * self.SLOT.size + 64
+
+    def append(self, host, rtt_ms, ttl=0, timestamp=None):
+        """Records one probe of "host" (rtt_ms None = lost) at "timestamp" (default now).
+        The record is written before the count, so readers never see a partial one.
+        Returns False, counting self.dropped, when "host" has no slot and none is free."""
+        slot = self.__slot(host, True)
+        if slot is None:
+            self.dropped += 1
+            return False
+        count_offset = self.__count_offset(slot)
+        count = self.COUNT.unpack_from(self.map, count_offset)[0]
+        offset = self.data_offset + (slot * self.capacity + count % self.capacity) * self.RECORD.size
+        lost = rtt_ms is None
+        self.RECORD.pack_into(self.map, offset, self.time() if timestamp is None else timestamp,
+                              float('nan') if lost else rtt_ms, ttl, lost)
+        self.COUNT.pack_into(self.map, count_offset, count + 1)
+        return True
+
+    def hosts(self):
+        """Returns the recorded host keys."""
+        self.__scan()
+        return list(self.slots)
+
+    def count(self, host):
+        """Returns the number of records ever appended for "host"."""
+        slot = self.__slot(host)
+        return 0 if slot is None else self.COUNT.unpack_from(self.map, self.__count_offset(slot))[0]
+
+    def records(self, host):
+        """Returns the host's stored records as a NumPy structured array (fields
+        time, rtt_ms, ttl, lost) viewing the mapping, without copying. Records
+        are in ring order: once the ring has wrapped, use ordered() for time order."""
+        import numpy
+        dtype = numpy.dtype(self.DTYPE)
+        slot = self.__slot(host)
+        if slot is None:
+            return numpy.zeros(0, dtype)
+        filled = min(self.count(host), self.capacity)
+        return numpy.frombuffer(self.map, dtype, filled, self.data_offset + slot * self.capacity * self.RECORD.size)
+
+    def ordered(self, host):
+        """Returns a copy of the host's records in time order."""
+        import numpy
+        records = self.records(host)
+        start = self.count(host) % self.capacity
+        if len(records) < self.capacity or start == 0:
+            return records.copy()
+        return numpy.concatenate((records[start:], records[:start]))
+
+    def window(self, host, minutes=None, since=None):
+        """Returns the host's records from the last "minutes" (or since unix time
+        "since"), in ring order. Without either, the records() view itself."""
+        records = self.records(host)
+        if minutes is not None:
+            since = self.time() - minutes * 60
+        if since is None:
+            return records
+        return records[records['time'] >= since]
+
+    def percentile(self, host, p, minutes=None, since=None):
+        """Returns the p-th percentile RTT in ms of the window's replies, None without replies."""
+        import numpy
+        records = self.window(host, minutes, since)
+        rtts = records['rtt_ms'][records['lost'] == 0]
+        return float(numpy.percentile(rtts, p)) if len(rtts) else None
+
+    def loss(self, host, minutes=None, since=None):
+        """Returns the fraction of lost probes in the window, None without records."""
+        records = self.window(host, minutes, since)
+        return float(records['lost'].mean()) if len(records) else None
+
+    def iter_records(self, host):
+        """Yields the host's records as (time, rtt_ms or None, ttl, lost) in time order. No numpy needed."""
+        slot = self.__slot(host)
+        if slot is None:
+            return
+        count = self.count(host)
+        ring_offset = self.data_offset + slot * self.capacity * self.RECORD.size
+        ring = memoryview(self.map)[ring_offset:ring_offset + min(count, self.capacity) * self.RECORD.size]
+        start = (count % self.capacity if count > self.capacity else 0) * self.RECORD.size
+        try:
+            for part in (ring[start:], ring[:start]):
+                for timestamp, rtt_ms, ttl, lost in self.RECORD.iter_unpack(part):
+                    yield timestamp, None if lost else rtt_ms, ttl, bool(lost)
+        finally:
+            ring.release()
+
+    def flush(self):
+        """Writes dirty pages to the file."""
+        self.map.flush()
+
+    def close(self):
+        """Unmaps and closes the file. NumPy views from records() must be gone by then."""
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class PingMetrics():
+    """
+    Counters, timers and an in-flight gauge for the ping engine, with optional
+    per-probe hooks. Attach one to a pinger (PyPing3(metrics=...) or
+    p.metrics = ...); without it the engine only pays an "is None" test per
+    batch or packet.
+
+    Counters: probes_sent, replies_matched, probes_timed_out, send_errors,
+    datagrams_received, stray_discarded (datagrams that matched no probe) and
+    select_wakeups. Timers, in ns: build (packet construction), checksum (the
+    checksum part of it: the full one's complement sum when a packet template
+    is built, the incremental update for every other probe, and checksum()
+    calls), parse (draining and parsing the receive queue) and resolve. in_flight is the number of
+    probes sent and not yet answered or timed out.
+
+    Hooks are called as hook(event, ip, sequence, delay) with event 'sent',
+    'reply' (delay in seconds) or 'timeout' (delay None).
+
+    >>> metrics = PingMetrics( labels={'job': 'sweep'} )
+    >>> metrics.hooks.append(lambda event, ip, sequence, delay: ...)
+    >>> p = PyPing3( metrics=metrics )
+    >>> metrics.snapshot()
+    >>> metrics.write_prometheus('/var/lib/node_exporter/pyping3.prom')
+    """
+
+    import os
+    from time import perf_counter_ns
+
+    COUNTERS = ('probes_sent', 'replies_matched', 'probes_timed_out', 'send_errors',
+                'datagrams_received', 'stray_discarded', 'select_wakeups')
+    TIMERS = ('build', 'checksum', 'parse', 'resolve')
+    PROBE_EVENTS = {'sent': ('probes_sent', 1), 'reply': ('replies_matched', -1), 'timeout': ('probes_timed_out', -1)}
+
+    def __init__(self, labels=None, prefix='pyping3'):
+        self.labels = labels or {}
+        self.prefix = prefix
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        """Zeroes all counters and timers (the in-flight gauge included)."""
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.timers_ns = dict.fromkeys(self.TIMERS, 0)
+        self.timer_calls = dict.fromkeys(self.TIMERS, 0)
+        self.in_flight = 0
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_time(self, name, ns):
+        self.timers_ns[name] += ns
+        self.timer_calls[name] += 1
+
+    def probe(self, event, ip, sequence, delay=None):
+        """Records a probe event ('sent', 'reply', 'timeout') and calls the hooks."""
+        name, in_flight = self.PROBE_EVENTS[event]
+        self.counters[name] += 1
+        self.in_flight += in_flight
+        for hook in self.hooks:
+            hook(event, ip, sequence, delay)
+
+    def drained(self, datagrams, matched, ns):
+        """Records one pass over the receive queue."""
+        self.counters['datagrams_received'] += datagrams
+        self.counters['stray_discarded'] += datagrams - matched
+        self.add_time('parse', ns)
+
+    def snapshot(self):
+        """Returns the current values as a flat dict (timers in seconds)."""
+        values = dict(self.counters)
+        for name in self.TIMERS:
+            values[name + '_seconds'] = self.timers_ns[name] / 1e9
+            values[name + '_calls'] = self.timer_calls[name]
+        values['in_flight'] = self.in_flight
+        return values
+
+    def prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        labels = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in sorted(self.labels.items()))
+        labels = '{' + labels + '}' if labels else ''
+        lines = []
+        def metric(name, kind, help, value):
+            name = self.prefix + '_' + name
+            lines.append('# HELP {} {}\n# TYPE {} {}\n{}{} {}\n'.format(name, help, name, kind, name, labels, value))
+        for name in self.COUNTERS:
+            metric(name + '_total', 'counter', name.replace('_', ' ').capitalize() + '.', self.counters[name])
+        for name in self.TIMERS:
+            metric(name + '_seconds_total', 'counter', 'Time spent in ' + name + '.', repr(self.timers_ns[name] / 1e9))
+            metric(name + '_calls_total', 'counter', 'Timed ' + name + ' calls.', self.timer_calls[name])
+        metric('probes_in_flight', 'gauge', 'Probes sent and not yet answered or timed out.', self.in_flight)
+        return ''.join(lines)
+
+    def write_prometheus(self, path):
+        """Writes prometheus() to "path" atomically (for the node_exporter textfile collector)."""
+        temp = path + '.tmp'
+        with open(temp, 'w') as file:
+            file.write(self.prometheus())
+        self.os.replace(temp, path)
+
 class PyPing3():
     """
     Python3 ICMP Ping
     -----------------
     
-    Pings host or ip address. Returns Dict containing: 'host', 'ip', 'size', 
-    'ttl', 'sent', 'recieved', 'lost', 'min_ms', 'max_ms', 'average_ms'
+    Pings host or ip address. Returns a PingResult, read like a Dict, containing:
+    'host', 'ip', 'size', 'ttl', 'sent', 'recieved', 'lost', 'min_ms', 'max_ms',
+    'average_ms', 'losspercent'
 
     Usage
     -----
@@ -44,23 +692,48 @@ class PyPing3():
     3: Reply from google.com, bytes=25 ttl=57 time=*93ms\n
     Packets: Sent=3, Received=3, Lost=0 (0.0% loss)\n
     Timing: Min=92ms, Max=94ms, Average=*93ms\n
+
+    The ICMP socket is opened when the instance is created and reused by every
+    ping() and ping_many() call. Each probe carries its own sequence number.
+    With socket_mode='auto' (default) an unprivileged Linux ping socket is
+    used when net.ipv4.ping_group_range allows it, otherwise a raw socket
+    ('raw' needs root/administrator). Close the socket with p.close() or use
+    the class as a context manager:
+
+    >>> with PyPing3() as p:
+    ...     res = p.ping('google.com')
     """
 
     from socket import socket, error, getprotobyname, gethostbyname, gethostbyaddr, htons
-    from socket import SOCK_DGRAM, inet_pton, AF_INET, AF_INET6, SOCK_RAW, gaierror, inet_aton
-    from struct import pack, unpack
+    from socket import SOCK_DGRAM, inet_pton, AF_INET, AF_INET6, SOCK_RAW, gaierror, inet_aton, inet_ntoa
+    from socket import SOL_SOCKET, SO_RCVBUF, IPPROTO_IP, IP_TTL, CMSG_SPACE
+    from sys import platform
+    from struct import pack, unpack, pack_into, unpack_from, calcsize
     from select import select
     from random import random
-    from time import time, sleep
+    from time import time, sleep, perf_counter_ns, time_ns
     
     ICMP_MAX_RECV = 2048
+    SWEEP_RCVBUF = 4 * 1024 * 1024 # Receive buffer for ping_many(), replies arrive in bursts
+    DRAIN_EVERY = 8 # Sends between reads of the socket while a round is being sent
     ICMP_ECHO_REQUEST = 8 # Echo request (per RFC792)
     ICMP_ECHOREPLY = 0 # Echo reply (per RFC792)
+    ICMP_UNREACHABLE = 3 # Destination unreachable (per RFC792)
+    ICMP_TIME_EXCEEDED = 11 # Time exceeded (per RFC792)
     ICMP_CODE = getprotobyname('icmp')
+    IP_HEADER_NAMES = ["version", "type", "length", "id", "flags", "ttl", "protocol", "checksum", "src_ip", "dest_ip"]
+    IP_HEADER_FORMAT = "!BBHHHBBHII"
+    SO_ATTACH_FILTER = 26 # Linux, <asm-generic/socket.h>
+    IP_RECVTTL = 12 # Linux, <linux/in.h>
+    SO_TIMESTAMPNS = 35 # Linux, <asm-generic/socket.h>, also the control message type
+    TTL_CMSG_SPACE = CMSG_SPACE(4)
+    STAMP_CMSG_SPACE = CMSG_SPACE(16) # struct timespec
+    PAYLOADS = {} # Payload size -> (payload, one's complement sum), shared by all instances
     ERROR_DESCR = {1: 'ERROR: ICMP messages can only be sent from processes running as root.',
+                   13: 'ERROR: ICMP ping sockets are not enabled for this group (sysctl net.ipv4.ping_group_range).',
                    10013: 'ERROR: ICMP messages can only be sent by users or processes with administrator rights.' }    
     
-    def __init__(self,ping_count=4,timeout=4,cached_stdout=False):
+    def __init__(self,ping_count=4,timeout=4,cached_stdout=False,dns_cache=None,socket_mode='auto',adaptive=False,max_losses=0,transport=None,precise=False,metrics=None):
         if ping_count < 1: ping_count = 1
         if timeout < 1: timeout = 1
         self.count = ping_count
@@ -68,89 +741,354 @@ class PyPing3():
         self.datasize = 0
         self.ip_header = None
         self.cached = cached_stdout
-        if not self.is_admin():
+        self.dns = dns_cache if dns_cache is not None else DNSCache()
+        self.sock = None
+        self.socket_mode = socket_mode
+        self.transport = transport
+        self.dgram = False
+        self.precise = precise
+        self.kernel_stamps = False
+        self.clock = self.perf_counter_ns # Send/receive timestamps in ns
+        self.rtt = RTTEstimator(max_timeout=timeout) if adaptive else None
+        self.max_losses = max_losses
+        self.reverse_dns = True
+        self.rate_limiter = None
+        self.metrics = metrics
+        self.history = None # RTTHistory fed by monitor() and ping_many()
+        self.packet_id = int(self.random() * 65535)
+        self.sequence = 0
+        self.payload_size = 192
+        self.template = None
+        self.recv_buffer = bytearray(self.ICMP_MAX_RECV)
+        self.recv_view = memoryview(self.recv_buffer)
+        if not self.can_ping():
             print('Insufficient privileges to open socket and send icmp ping.')
             return
 
-    def __checksum(self, source_string):
-        checksum = 0
-        count_to = (len(source_string) / 2) * 2
-        count = 0
-        while count < count_to:
-            this_val = source_string[count + 1] * 256 + source_string[count]
-            checksum += this_val
-            checksum &= 0xffffffff # Necessary?
-            count += 2
-        if count_to < len(source_string):
-            checksum += source_string[len(source_string) - 1]
-            checksum &= 0xffffffff  # Necessary?
-        checksum = (checksum >> 16) + (checksum & 0xffff)
-        checksum += checksum >> 16
-        answer = ~checksum
-        answer &= 0xffff
-        answer = answer >> 8 | (answer << 8 & 0xff00)
-        return answer
+    def __ones_sum(self, data):
+        """16 bit one's complement sum of "data" as little endian words.
+        Since 65536 = 1 (mod 0xffff) the sum of all words equals the whole buffer
+        read as one integer modulo 0xffff, so int.from_bytes() does the word loop
+        in C for any payload length (an odd trailing byte is the low byte)."""
+        total = int.from_bytes(data, 'little')
+        ones_sum = total % 0xffff
+        if ones_sum == 0 and total:
+            return 0xffff # Negative zero
+        return ones_sum
+
+    def __ones_add(self, a, b):
+        """One's complement addition of two 16 bit values."""
+        total = a + b
+        return (total & 0xffff) + (total >> 16)
+
+    def checksum(self, source_string):
+        """RFC 1071 internet checksum of "source_string" in network byte order."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = self.perf_counter_ns()
+        answer = ~self.__ones_sum(source_string) & 0xffff
+        if metrics is not None:
+            metrics.add_time('checksum', self.perf_counter_ns() - start)
+        return answer >> 8 | (answer << 8 & 0xff00)
+
+    def __payload(self, size):
+        """Returns (payload, one's complement sum) for "size", computed once per size."""
+        entry = self.PAYLOADS.get(size)
+        if entry is None:
+            data = size * b'Q'
+            entry = self.PAYLOADS[size] = (data, self.__ones_sum(data))
+        return entry
+
+    def _create_packet(self, id, sequence=1):
+        """Create a new echo request packet based on the given "id" and "sequence"."""
+        metrics = self.metrics
+        if metrics is None:
+            return self.__build_packet(id, sequence)
+        start = self.perf_counter_ns()
+        packet = self.__build_packet(id, sequence)
+        metrics.add_time('build', self.perf_counter_ns() - start)
+        return packet
+
+    def __build_packet(self, id, sequence):
+        """Builds the echo request for _create_packet().
 
-    def __create_packet(self, id):
-        """Create a new echo request packet based on the given "id"."""
+        The packet is patched into a template built once per payload size. Only
+        the id and sequence words change between probes, so the checksum is
+        updated incrementally (RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m')) instead
+        of summing the whole packet again."""
         # Header is type (8), code (8), checksum (16), id (16), sequence (16)
-        header = self.pack('bbHHh', self.ICMP_ECHO_REQUEST, 0, 0, id, 1)
-        data = 192 * b'Q'
-        header = self.pack('bbHHh', self.ICMP_ECHO_REQUEST, 0, self.htons(self.__checksum(header + data)), id, 1)
-        return header + data
+        metrics = self.metrics
+        template = self.template
+        if template is None or len(template) != 8 + self.payload_size:
+            if metrics is not None:
+                start = self.perf_counter_ns()
+            data, data_sum = self.__payload(self.payload_size)
+            header = self.pack('bbHHH', self.ICMP_ECHO_REQUEST, 0, 0, id, sequence)
+            checksum = ~self.__ones_add(self.__ones_sum(header), data_sum) & 0xffff
+            if metrics is not None:
+                metrics.add_time('checksum', self.perf_counter_ns() - start)
+            template = self.template = bytearray(header + data)
+            self.pack_into('<H', template, 2, checksum)
+            return bytes(template)
+        checksum, old_id, old_sequence = self.unpack_from('<HHH', template, 2)
+        self.pack_into('HH', template, 4, id, sequence)
+        if metrics is not None:
+            start = self.perf_counter_ns()
+        new_id, new_sequence = self.unpack_from('<HH', template, 4)
+        total = ~checksum & 0xffff
+        total = self.__ones_add(total, ~old_id & 0xffff)
+        total = self.__ones_add(total, new_id)
+        total = self.__ones_add(total, ~old_sequence & 0xffff)
+        total = self.__ones_add(total, new_sequence)
+        self.pack_into('<H', template, 2, ~total & 0xffff)
+        if metrics is not None:
+            metrics.add_time('checksum', self.perf_counter_ns() - start)
+        return bytes(template)
 
     def header2dict(self, names, struct_format, data):
         """ unpack the raw received IP and ICMP header informations to a dict """
         unpacked_data = self.unpack(struct_format, data)
         return dict(zip(names, unpacked_data))
 
-    def __response_handler(self, sock, packet_id, time_sent, timeout):
-        """Handles packet response, returning either the delay or timing out (returns "None")."""
+    def _drain(self, sock, pending, first=False):
+        """Reads every datagram already queued on the non-blocking "sock" and
+        returns the matches for "pending" (see __drain()), recording the pass
+        in self.metrics when set."""
+        metrics = self.metrics
+        if metrics is None:
+            return self.__drain(sock, pending, first)[0]
+        start = self.perf_counter_ns()
+        matched, datagrams = self.__drain(sock, pending, first)
+        metrics.drained(datagrams, len(matched), self.perf_counter_ns() - start)
+        return matched
+
+    def __drain(self, sock, pending, first):
+        """Reads every datagram already queued on the non-blocking "sock" into the
+        preallocated receive buffer and parses it in place. Echo replies whose
+        (source ip, id, sequence) is a key of "pending" are popped from it.
+        Anything else (requests, other processes' replies, stray ICMP) is
+        dropped before any object besides the lookup key is built.
+        Returns ([(value, time_received, ttl), ...], datagrams read), where value
+        is the popped "pending" value. With "first" set, returns at the first
+        match so the matching datagram is still in the receive buffer.
+        Ping sockets deliver the ICMP message without IP header; their TTL comes
+        from the IP_TTL control message instead. time_received is in ns of
+        self.clock: the kernel receive timestamp when kernel_stamps is set,
+        otherwise read when the datagram is dequeued."""
+        buf = self.recv_buffer
+        view = self.recv_view
+        dgram = self.dgram
+        stamps = self.kernel_stamps
+        cmsg_space = (self.TTL_CMSG_SPACE if dgram else 0) + (self.STAMP_CMSG_SPACE if stamps else 0)
+        clock = self.clock
+        matched = []
+        datagrams = 0
         while True:
-            ready = self.select([sock], [], [], self.timeout)
+            try:
+                if cmsg_space:
+                    nbytes, ancdata, flags, addr = sock.recvmsg_into([buf], cmsg_space)
+                else:
+                    nbytes, addr = sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                return matched, datagrams
+            time_received = clock()
+            datagrams += 1
+            ihl = 0 if dgram else (view[0] & 0x0f) * 4
+            if nbytes < ihl + 8 or view[ihl] != self.ICMP_ECHOREPLY:
+                continue
+            rec_id, rec_sequence = self.unpack_from('HH', view, ihl + 4)
+            value = pending.pop((addr[0], rec_id, rec_sequence), None)
+            if value is not None:
+                ttl = view[8]
+                if cmsg_space:
+                    ttl, time_received = self.__ancillary(ancdata, ttl, time_received)
+                matched.append((value, time_received, ttl))
+                if first:
+                    return matched, datagrams
+
+    def __ancillary(self, ancdata, ttl, time_received):
+        """Returns (ttl, time_received) from recvmsg() control messages: the IP_TTL
+        of a ping socket and the SO_TIMESTAMPNS kernel receive time in ns, keeping
+        the given values when a message is missing."""
+        for level, type, data in ancdata:
+            if level == self.IPPROTO_IP and type == self.IP_TTL:
+                ttl = self.unpack('i', data[:4])[0]
+            elif level == self.SOL_SOCKET and type == self.SO_TIMESTAMPNS:
+                seconds, nanoseconds = self.unpack('ll', data[:self.calcsize('ll')])
+                time_received = seconds * 1000000000 + nanoseconds
+        return ttl, time_received
+
+    def __response_handler(self, sock, dest_addr, packet_id, sequence, time_sent, timeout):
+        """Handles packet response, returning either the delay or timing out (returns "None").
+        Only an echo reply from "dest_addr" carrying both "packet_id" and "sequence"
+        counts, so late replies to earlier probes on the session socket are discarded.
+        "time_sent" is in ns of self.clock, the delay is returned in seconds."""
+        deadline = self.time() + timeout
+        pending = {(dest_addr, packet_id, sequence): time_sent}
+        while pending:
+            ready = self.select([sock], [], [], max(deadline - self.time(), 0))
+            if self.metrics is not None:
+                self.metrics.count('select_wakeups')
             if ready[0] == []:  # Timeout
                 return
-            time_received = self.time()
-            rec_packet, addr = sock.recvfrom(self.ICMP_MAX_RECV)
-            icmp_header = rec_packet[20:28]
-
-            self.ip_header = self.header2dict(
-                names = ["version", "type", "length",
-                    "id", "flags", "ttl", "protocol",
-                    "checksum", "src_ip", "dest_ip"],
-                struct_format = "!BBHHHBBHII",
-                data = rec_packet[:20])
-            
-            type, code, checksum, rec_id, sequence = self.unpack('bbHHh', icmp_header)
-            if rec_id == packet_id:
-                return time_received - time_sent
-            timeout -= time_received - time_sent
-            if timeout <= 0:
-                return
+            for time_sent, time_received, ttl in self._drain(sock, pending, first=True):
+                if self.dgram: # The kernel strips the IP header from ping socket replies
+                    self.ip_header = {'ttl': ttl}
+                else:
+                    self.ip_header = self.header2dict(self.IP_HEADER_NAMES, self.IP_HEADER_FORMAT, self.recv_view[:20])
+                return (time_received - time_sent) / 1e9
 
-    def __echo(self, dest_addr, timeout=1):
-        """echo"""
+    def _open_socket(self):
+        """Opens the ICMP socket for "socket_mode", translating permission errors.
+
+        'dgram' opens a Linux ping socket (SOCK_DGRAM, IPPROTO_ICMP). It needs no
+        root, only membership of net.ipv4.ping_group_range, and the kernel only
+        delivers echo replies for the socket's own echo id. 'raw' opens a raw
+        socket (root/administrator). 'auto' tries a ping socket first on Linux.
+
+        A "transport" (any object whose open() returns a socket-like object with
+        raw socket semantics, e.g. FakeICMPResponder) replaces the ICMP socket."""
+        if self.transport is not None:
+            self.dgram = False
+            return self.transport.open()
         try:
-            sock = self.socket(self.AF_INET, self.SOCK_RAW, self.ICMP_CODE)
+            if self.socket_mode in ('auto', 'dgram') and self.platform.startswith('linux'):
+                try:
+                    sock = self.socket(self.AF_INET, self.SOCK_DGRAM, self.ICMP_CODE)
+                    self.dgram = True
+                    return sock
+                except self.error:
+                    if self.socket_mode == 'dgram':
+                        raise
+            self.dgram = False
+            return self.socket(self.AF_INET, self.SOCK_RAW, self.ICMP_CODE)
         except self.error as exc:
             error_number, msg = exc.args
-            if error_number in ERROR_DESCR:
+            if error_number in self.ERROR_DESCR:
                 # Operation not permitted
-                raise error('%s\n%s' % ((msg, ERROR_DESCR[error_number])))
+                raise self.error('%s\n%s' % ((msg, self.ERROR_DESCR[error_number])))
             raise  # Raises the original error
+
+    def __attach_filter(self, sock, packet_id, errors=False):
+        """Attaches a classic BPF program to the raw socket so the kernel only
+        queues echo replies carrying "packet_id" (and with "errors" all time
+        exceeded and destination unreachable messages, for traceroute()). All
+        other ICMP traffic seen by the host is dropped before it is copied into
+        this process. Linux only, best effort: without the filter _drain() still
+        discards those packets."""
+        import ctypes
+        id_field = int.from_bytes(self.pack('H', packet_id), 'big') # BPF loads halfwords big endian
+        if errors:
+            program = [
+                (0xb1, 0, 0, 0),                       # ldxb 4*([0]&0xf)  X = IP header length
+                (0x50, 0, 0, 0),                       # ldb [x+0]         ICMP type
+                (0x15, 2, 0, self.ICMP_ECHOREPLY),     # jeq #0, check the id
+                (0x15, 3, 0, self.ICMP_TIME_EXCEEDED), # jeq #11, accept
+                (0x15, 2, 3, self.ICMP_UNREACHABLE),   # jeq #3, accept, else drop
+                (0x48, 0, 0, 4),                       # ldh [x+4]         ICMP id
+                (0x15, 0, 1, id_field),                # jeq #id, else drop
+                (0x06, 0, 0, 0x40000),                 # ret #0x40000      accept
+                (0x06, 0, 0, 0),                       # ret #0            drop
+            ]
+        else:
+            program = [
+                (0xb1, 0, 0, 0),                   # ldxb 4*([0]&0xf)  X = IP header length
+                (0x50, 0, 0, 0),                   # ldb [x+0]         ICMP type
+                (0x15, 0, 3, self.ICMP_ECHOREPLY), # jeq #0, else drop
+                (0x48, 0, 0, 4),                   # ldh [x+4]         ICMP id
+                (0x15, 0, 1, id_field),            # jeq #id, else drop
+                (0x06, 0, 0, 0x40000),             # ret #0x40000      accept
+                (0x06, 0, 0, 0),                   # ret #0            drop
+            ]
+        code = ctypes.create_string_buffer(b''.join(self.pack('HBBI', *insn) for insn in program))
+        try:
+            sock.setsockopt(self.SOL_SOCKET, self.SO_ATTACH_FILTER, self.pack('HL', len(program), ctypes.addressof(code)))
+        except self.error:
+            pass
+
+    def _session_socket(self):
+        """Returns the session socket, opening it on first use. It stays open until close().
+        The socket is non-blocking: select() waits, _drain() empties the queue.
+        A ping socket is bound to the session id (the kernel rewrites the echo id
+        to the bound one); a raw socket gets a kernel filter for the session id.
+        In precise mode on Linux the socket also gets SO_TIMESTAMPNS kernel
+        receive timestamps, which are wall clock, so self.clock becomes time_ns."""
+        if self.sock is None:
+            sock = self._open_socket()
+            sock.setblocking(False)
+            if self.dgram:
+                try:
+                    sock.bind(('', self.unpack('!H', self.pack('H', self.packet_id))[0]))
+                except self.error:
+                    sock.bind(('', 0)) # Id in use, let the kernel pick one
+                # The kernel writes the bound id in network byte order, ids here are native
+                self.packet_id = self.unpack('H', self.pack('!H', sock.getsockname()[1]))[0]
+                sock.setsockopt(self.IPPROTO_IP, self.IP_RECVTTL, 1)
+            elif self.platform.startswith('linux'):
+                self.__attach_filter(sock, self.packet_id)
+            self.kernel_stamps = False
+            if self.precise and self.platform.startswith('linux'):
+                try:
+                    sock.setsockopt(self.SOL_SOCKET, self.SO_TIMESTAMPNS, 1)
+                    self.kernel_stamps = True
+                except self.error:
+                    pass
+            self.clock = self.time_ns if self.kernel_stamps else self.perf_counter_ns
+            self.sock = sock
+        return self.sock
+
+    def can_ping(self):
+        """True when an ICMP socket can be opened: a raw socket as root/administrator,
+        or an unprivileged Linux ping socket. Opens the session socket."""
+        try:
+            self._session_socket()
+        except self.error:
+            return False
+        return True
+
+    def close(self):
+        """Closes the session socket. The next ping opens a new one."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_sequence(self):
+        """Returns the next probe sequence number (1-65535, wrapping)."""
+        self.sequence = self.sequence % 0xffff + 1
+        return self.sequence
+
+    def __echo(self, dest_addr, timeout=1):
+        """echo"""
         try:
-            self.gethostbyname(dest_addr)
+            dest_addr = self.dns.gethostbyname(dest_addr)
         except self.gaierror:
             return
-        packet_id = int((id(self.timeout) * self.random()) % 65535)
-        packet = self.__create_packet(packet_id)
+        sock = self._session_socket()
+        sequence = self._next_sequence()
+        packet = self._create_packet(self.packet_id, sequence)
         self.datasize = packetsize = round(len(packet)/8)
+        metrics = self.metrics
+        time_sent = self.clock() # Before sendto(): loopback replies can arrive within the call
         while packet:
             dummy_port = 1 # The icmp protocol does not use a port
-            sent = sock.sendto(packet, (dest_addr, dummy_port))
+            try:
+                sent = sock.sendto(packet, (dest_addr, dummy_port))
+            except BlockingIOError: # Send buffer full, counts as lost
+                if metrics is not None:
+                    metrics.count('send_errors')
+                return
             packet = packet[sent:]
-        delay = self.__response_handler(sock, packet_id, self.time(), self.timeout)
-        sock.close()
+        if metrics is None:
+            return self.__response_handler(sock, dest_addr, self.packet_id, sequence, time_sent, timeout)
+        metrics.probe('sent', dest_addr, sequence)
+        delay = self.__response_handler(sock, dest_addr, self.packet_id, sequence, time_sent, timeout)
+        metrics.probe('timeout' if delay is None else 'reply', dest_addr, sequence, delay)
         return delay
 
     def __is_valid_ipv4(self, address):
@@ -200,7 +1138,7 @@ class PyPing3():
     def showdata(self,pingdict,verbose=True):
         """showdata(self, pingdict, verbose=True)"""
         s = ''
-        if isinstance(pingdict, dict):
+        if isinstance(pingdict, Mapping):
             sHost = pingdict['host']
             sIP = pingdict['ip']
             size = pingdict['size']
@@ -228,99 +1166,1115 @@ class PyPing3():
             print(s)
         return s
     
+    def _resolve(self, host_or_ip):
+        """Returns (host, ip) for a host name or ip address. Unresolvable hosts get ip '0.0.0.0'."""
+        if self.__is_valid_ip(host_or_ip):
+            sIP = host_or_ip
+            sHost = sIP
+            if self.reverse_dns:
+                try:
+                    sHost = self.dns.gethostbyaddr(sIP)[0]
+                except:
+                    pass
+        else:
+            sHost = host_or_ip
+            try:
+                sIP = self.dns.gethostbyname(host_or_ip)
+            except:
+                sIP = '0.0.0.0'
+        return sHost, sIP
+
+    def resolve_many(self, hosts, workers=64):
+        """resolve_many(self, hosts, workers=64)
+
+        Resolves all hosts in parallel through the resolver cache, returning a
+        list of (host, ip) in the order of "hosts". Used by ping_many() and
+        useful to warm the cache before a sweep."""
+        from concurrent.futures import ThreadPoolExecutor
+        start = self.perf_counter_ns()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            resolved = list(pool.map(self._resolve, hosts))
+        if self.metrics is not None:
+            self.metrics.add_time('resolve', self.perf_counter_ns() - start)
+        return resolved
+
+    def _probe_timeout(self, sIP):
+        """Seconds to wait for a reply from "sIP": the adaptive estimate or "timeout"."""
+        if self.rtt is None:
+            return self.timeout
+        return self.rtt.timeout(sIP)
+
+    def _record(self, sIP, delay):
+        """Feeds a probe outcome (delay in seconds, None = lost) to the adaptive estimator."""
+        if self.rtt is not None:
+            if delay is None:
+                self.rtt.lost(sIP)
+            else:
+                self.rtt.observe(sIP, delay)
+
+    def _give_up(self, delays):
+        """True when the last "max_losses" probes were lost and no reply was ever seen.
+        The remaining probes are then not sent (and not counted in 'sent')."""
+        return 0 < self.max_losses <= len(delays) and delays.count(None) == len(delays)
+
+    def _delay_ms(self, delay):
+        """Rounds a delay in seconds to whole ms. Returns (ms, '<') when rounded up from 0.
+        In precise mode returns fractional ms, rounded to microseconds."""
+        if self.precise:
+            return round(delay * 1000, 3), ''
+        delay = round(delay * 1000)
+        if delay == 0:
+            return 1, '<'
+        return delay, ''
+
+    def _summary(self, sHost, sIP, delays, ttl):
+        """Builds the result values, in PingResult.KEYS order, from per-probe delays in ms (None = lost).
+        Probes skipped after max_losses gave up are not counted as sent or lost."""
+        replies = [d for d in delays if d is not None]
+        recieved = len(replies)
+        mindelay = min(replies) if replies else 0
+        maxdelay = max(replies) if replies else 0
+        averagedelay = round(sum(replies)/self.count, 3) if self.precise else round(sum(replies)/self.count)
+        sent = self.max_losses if self._give_up(delays[:self.max_losses]) else self.count
+        lost = sent-recieved
+        losspercent = (lost*100)/sent
+        if round(losspercent) == 100:
+            mindelay = round(self.timeout * 1000)
+            maxdelay = round(self.timeout * 1000)
+            averagedelay = round(self.timeout * 1000)
+        return (sHost,sIP,self.datasize,ttl,sent,recieved,lost,mindelay,maxdelay,averagedelay,losspercent)
+
     def ping(self, host_or_ip_to_ping,verbose=False):
         """ping(self, host_or_ip_to_ping, verbose=False)"""
-        if not self.is_admin():
+        if not self.can_ping():
             print('Ping not possible: Insufficient privileges.')
             return
         replycnt = 0
-        delaysum = 0
-        recieved = 0
-        mindelay = self.timeout * 1000
-        maxdelay = 0
-        averagedelay = 0
-        sIP = ''
-        sHost = ''
+        delays = []
         ttl = 0
-        s2c = ''
-        if self.__is_valid_ip(host_or_ip_to_ping):
-            sIP = host_or_ip_to_ping
-            try:
-                sHost = self.gethostbyaddr(sIP)[0]
-            except:
-                sHost = sIP
-        else:
-            sHost = host_or_ip_to_ping
-            try:
-                sIP = self.gethostbyname(host_or_ip_to_ping)
-            except:
-                sIP = '0.0.0.0'
-        if sIP is '0.0.0.0':
-            mindelay = 0
+        s2c = [] # Probe lines, printed at once with cached_stdout
+        start = self.perf_counter_ns()
+        sHost, sIP = self._resolve(host_or_ip_to_ping)
+        if self.metrics is not None:
+            self.metrics.add_time('resolve', self.perf_counter_ns() - start)
+        if sIP == '0.0.0.0':
             if verbose:
                 s1 = 'Unable to resolve '+host_or_ip_to_ping+' [0.0.0.0]:'
                 if not self.cached:
                     print(s1)
         else:
             for i in range(self.count):
-                corrected_delay = False
-                corrected_str = ''
                 replycnt += 1
-                delay = self.__echo(host_or_ip_to_ping, self.timeout)
-                ttl = self.ip_header['ttl']
-                if replycnt is 1:
+                if self._give_up(delays):
+                    delays.append(None)
+                    if verbose:
+                        s2t = str(replycnt).zfill(len(str(self.count)))+": Request not sent, host is not responding."
+                        if not self.cached:
+                            print(s2t)
+                        else:
+                            s2c.append(s2t)
+                    continue
+                delay = self.__echo(host_or_ip_to_ping, self._probe_timeout(sIP))
+                self._record(sIP, delay)
+                if replycnt == 1:
                     if verbose:
                         s1 = 'Pinging '+sHost+' ['+sIP+'] with '+str(self.datasize)+' bytes of data:'
                         if not self.cached:
                             print(s1)
                 if delay is None:
+                    delays.append(None)
                     s2t = str(replycnt).zfill(len(str(self.count)))+": Request timed out."
                     if verbose:
                         if not self.cached:
                             print(s2t)
                         else:
-                            s2c += s2t+'\n'
+                            s2c.append(s2t)
                 else:
-                    delay = round(delay * 1000)
-                    if delay is 0:
-                        delay += 1
-                        corrected_delay = True
-                        corrected_str = '<'
-                    delaysum += delay
-                    recieved += 1
-                    if delay < mindelay:
-                        mindelay = delay
-                    if delay > maxdelay:
-                        maxdelay = delay
+                    delay, corrected_str = self._delay_ms(delay)
+                    delays.append(delay)
+                    ttl = self.ip_header['ttl']
                     if verbose:
                         s2 = str(replycnt).zfill(len(str(self.count)))+": Reply from {}, bytes={} ttl={} time={}{}ms".format(host_or_ip_to_ping, self.datasize, ttl, corrected_str, delay)
                         if not self.cached:
                             print(s2)
                         else:
-                            s2c += s2+'\n'
+                            s2c.append(s2)
                 self.sleep(0.1)
-        averagedelay = round(delaysum/self.count)
-        lost = self.count-recieved
-        losspercent = (lost*100)/self.count
-        if round(losspercent) is 100:
-            mindelay = self.timeout * 1000
-            maxdelay = self.timeout * 1000
-            averagedelay = self.timeout * 1000
+        res = PingResult(*self._summary(sHost, sIP, delays, ttl))
         if verbose:
-            s3 = 'Packets: Sent = '+str(self.count)+', Received = '+str(recieved)+', Lost = '+str(lost)+' ('+format(losspercent,'.1f')+'% loss)'
-            s4 = 'Timing: Min = '+str(mindelay)+'ms, Max = '+str(maxdelay)+'ms, Average = '+str(averagedelay)+'ms'            
+            s3 = 'Packets: Sent = '+str(res['sent'])+', Received = '+str(res['recieved'])+', Lost = '+str(res['lost'])+' ('+format(res['losspercent'],'.1f')+'% loss)'
+            s4 = 'Timing: Min = '+str(res['min_ms'])+'ms, Max = '+str(res['max_ms'])+'ms, Average = '+str(res['average_ms'])+'ms'
             if not self.cached:
                 print(s3)
                 print(s4+'\n')
             else:
-                print(s1+'\n'+s2c+s3+'\n'+s4+'\n')
-        keys = ['host','ip','size','ttl','sent','recieved','lost','min_ms','max_ms','average_ms','losspercent']
-        values = [sHost,sIP,self.datasize,ttl,self.count,recieved,lost,mindelay,maxdelay,averagedelay,losspercent]
-        return dict(zip(keys,values))
+                print('\n'.join([s1] + s2c + [s3, s4]) + '\n')
+        return res
+
+    def ping_many(self, hosts):
+        """ping_many(self, hosts)
+
+        Pings all hosts concurrently over the session socket and returns a
+        ResultBatch (columnar, indexable like a list of ping() results) in the
+        order of "hosts".
+        Each round sends one echo request to every host and then collects
+        replies until "timeout" expires or every host has answered, so a sweep
+        takes about count * timeout regardless of the number of hosts.
+        Every probe gets its own sequence number under the session id, and
+        replies are matched on (source ip, id, sequence). In adaptive mode each
+        probe has its own deadline, and hosts given up on by max_losses are
+        skipped in later rounds."""
+        if not self.can_ping():
+            print('Ping not possible: Insufficient privileges.')
+            return
+        targets = self.resolve_many(hosts)
+        delays = [[] for t in targets]
+        ttls = [0] * len(targets)
+        history = self.history
+        for probe in range(self.count):
+            for idx, delay, ttl in self._probe_round(targets, lambda idx: self._give_up(delays[idx])):
+                if history is not None and ttl is not None: # Skipped probes were never sent
+                    history.append(targets[idx][1], None if delay is None else delay * 1000, ttl)
+                if delay is None:
+                    delays[idx].append(None)
+                else:
+                    delays[idx].append(self._delay_ms(delay)[0])
+                    ttls[idx] = ttl
+            if probe < self.count-1:
+                self.sleep(0.1)
+        batch = ResultBatch(self.precise)
+        for idx, (sHost, sIP) in enumerate(targets):
+            batch.append(self._summary(sHost, sIP, delays[idx], ttls[idx]))
+        return batch
+
+    def _probe_round(self, targets, skip=None):
+        """Sends one echo request to every resolved (host, ip) in "targets" and
+        yields (idx, delay, ttl) for each probe as soon as its reply arrives or
+        its deadline passes (delay in seconds, None = lost). Targets for which
+        skip(idx) is true yield (idx, None, None) without being probed; unresolved targets
+        yield nothing. Replies are read every DRAIN_EVERY sends and while waiting
+        for the rate limiter, so they are not left queued (and timestamped late)
+        until the whole round has been sent."""
+        sock = self._session_socket()
+        try:
+            sock.setsockopt(self.SOL_SOCKET, self.SO_RCVBUF, self.SWEEP_RCVBUF)
+        except self.error:
+            pass
+        packet_id = self.packet_id
+        rate_limiter = self.rate_limiter
+        clock = self.clock
+        metrics = self.metrics
+        pending = {}
+        deadlines = []
+        def replies():
+            for (idx, time_sent, sequence), time_received, ttl in self._drain(sock, pending):
+                delay = (time_received - time_sent) / 1e9
+                self._record(targets[idx][1], delay)
+                if metrics is not None:
+                    metrics.probe('reply', targets[idx][1], sequence, delay)
+                yield idx, delay, ttl
+        sends = 0
+        for idx, (sHost, sIP) in enumerate(targets):
+            if sIP == '0.0.0.0':
+                continue
+            if skip is not None and skip(idx):
+                yield idx, None, None # Not sent
+                continue
+            sequence = self._next_sequence()
+            packet = self._create_packet(packet_id, sequence)
+            self.datasize = round(len(packet)/8)
+            if rate_limiter is not None:
+                due = rate_limiter.reserve()
+                while True: # Read replies instead of sleeping
+                    wait = due - rate_limiter.monotonic()
+                    if wait <= 0:
+                        break
+                    if self.select([sock], [], [], wait)[0]:
+                        yield from replies() # Also discards strays, or select() returns at once again
+            sends += 1
+            if pending and sends % self.DRAIN_EVERY == 0:
+                yield from replies()
+            time_sent = clock()
+            try:
+                sock.sendto(packet, (sIP, 1)) # The icmp protocol does not use a port
+            except self.error:
+                if metrics is not None:
+                    metrics.count('send_errors')
+                yield idx, None, 0 # e.g. ENOBUFS, counts as lost
+                continue
+            if metrics is not None:
+                metrics.probe('sent', sIP, sequence)
+            pending[(sIP, packet_id, sequence)] = (idx, time_sent, sequence)
+            deadlines.append((self.time() + self._probe_timeout(sIP), (sIP, packet_id, sequence)))
+        deadlines.sort() # Adaptive deadlines differ per host
+        expired = 0
+        while pending:
+            now = self.time()
+            while expired < len(deadlines) and deadlines[expired][0] <= now:
+                key = deadlines[expired][1]
+                expired += 1
+                if key in pending:
+                    idx, time_sent, sequence = pending.pop(key)
+                    self._record(key[0], None)
+                    if metrics is not None:
+                        metrics.probe('timeout', key[0], sequence)
+                    yield idx, None, 0
+            if not pending:
+                break
+            ready = self.select([sock], [], [], deadlines[expired][0] - now)
+            if metrics is not None:
+                metrics.count('select_wakeups')
+            if ready[0] == []:  # Timeout
+                continue
+            yield from replies()
+
+    def monitor(self, hosts, interval=1.0, rounds=None, window=100):
+        """monitor(self, hosts, interval=1.0, rounds=None, window=100)
+
+        Continuous monitoring generator. Every "interval" seconds (or as soon
+        as the previous round's deadlines have passed, if that takes longer)
+        one echo request is sent to every host, forever or "rounds" times. A
+        dict is yielded per probe as soon as it is answered or times out:
+
+        {'host', 'ip', 'round', 'time', 'rtt_ms' (None = lost), 'ttl', 'stats'}
+
+        'stats' is the host's RollingStats (percentiles, jitter, loss over the
+        last "window" probes), updated in constant memory and also available
+        as self.stats[index of the host in "hosts"]."""
+        if not self.can_ping():
+            print('Ping not possible: Insufficient privileges.')
+            return
+        targets = self.resolve_many(hosts)
+        self.stats = [RollingStats(window) for t in targets]
+        start = self.time()
+        round_number = 0
+        while rounds is None or round_number < rounds:
+            for idx, delay, ttl in self._probe_round(targets):
+                rtt_ms = None if delay is None else delay * 1000
+                stats = self.stats[idx]
+                stats.add(rtt_ms)
+                now = self.time()
+                if self.history is not None:
+                    self.history.append(targets[idx][1], rtt_ms, ttl, now)
+                yield {'host': targets[idx][0], 'ip': targets[idx][1], 'round': round_number,
+                       'time': now, 'rtt_ms': rtt_ms, 'ttl': ttl, 'stats': stats}
+            round_number += 1
+            wait = start + round_number * interval - self.time()
+            if wait > 0 and (rounds is None or round_number < rounds):
+                self.sleep(wait)
+
+    def _trace_socket(self):
+        """Opens the socket for traceroute(): the transport's, or a raw socket,
+        since ping sockets only report ICMP errors through the error queue. On
+        Linux its filter passes this session's echo replies and ICMP errors."""
+        if self.transport is not None:
+            sock = self.transport.open()
+        else:
+            try:
+                sock = self.socket(self.AF_INET, self.SOCK_RAW, self.ICMP_CODE)
+            except self.error as exc:
+                error_number, msg = exc.args
+                if error_number in self.ERROR_DESCR:
+                    raise self.error('%s\n%s' % ((msg, self.ERROR_DESCR[error_number])))
+                raise
+            if self.platform.startswith('linux'):
+                self.__attach_filter(sock, self.packet_id, errors=True)
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(self.SOL_SOCKET, self.SO_RCVBUF, self.SWEEP_RCVBUF)
+        except self.error:
+            pass
+        return sock
+
+    def __drain_trace(self, sock, pending):
+        """Reads every queued datagram and returns the probes of "pending" they
+        answer as (value, hop ip, time_received, final). An echo reply answers
+        its own (source ip, id, sequence). A time exceeded or destination
+        unreachable message quotes the probe's IP header and first 8 ICMP bytes,
+        which give its (destination ip, id, sequence). "final" is set when the
+        destination itself answered."""
+        buf = self.recv_buffer
+        view = self.recv_view
+        clock = self.perf_counter_ns
+        matched = []
+        while True:
+            try:
+                nbytes, addr = sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                return matched
+            time_received = clock()
+            ihl = (view[0] & 0x0f) * 4
+            if nbytes < ihl + 8:
+                continue
+            icmp_type = view[ihl]
+            if icmp_type == self.ICMP_ECHOREPLY:
+                dest_ip = addr[0]
+                offset = ihl + 4
+            elif icmp_type == self.ICMP_TIME_EXCEEDED or icmp_type == self.ICMP_UNREACHABLE:
+                inner = ihl + 8
+                if nbytes < inner + 20:
+                    continue
+                header = self.header2dict(self.IP_HEADER_NAMES, self.IP_HEADER_FORMAT, view[inner:inner + 20])
+                offset = inner + (header['version'] & 0x0f) * 4
+                if nbytes < offset + 8 or view[offset] != self.ICMP_ECHO_REQUEST:
+                    continue
+                dest_ip = self.inet_ntoa(self.pack('!I', header['dest_ip']))
+                offset += 4
+            else:
+                continue
+            rec_id, rec_sequence = self.unpack_from('HH', view, offset)
+            value = pending.pop((dest_ip, rec_id, rec_sequence), None)
+            if value is not None:
+                matched.append((value, addr[0], time_received, addr[0] == dest_ip))
+
+    def traceroute(self, hosts, max_hops=30, probes=3):
+        """traceroute(self, hosts, max_hops=30, probes=3)
+
+        Traces the path to every host at once. Each of "probes" rounds sends an
+        echo request with every TTL from 1 to "max_hops" to every host over one
+        raw socket, then collects replies until "timeout" expires. Routers
+        answer with time exceeded messages quoting the probe, so replies are
+        matched to their TTL in any order; an echo reply (or unreachable) from
+        the host itself ends the path, and later rounds stop at that TTL. A trace
+        takes about probes * timeout regardless of path length or host count.
+
+        Returns a list in the order of "hosts" of
+        {'host', 'ip', 'reached', 'hops': [{'ttl', 'ip', 'sent', 'recieved',
+        'lost', 'losspercent', 'min_ms', 'average_ms', 'max_ms'}, ...]}.
+        The hops end at the host if reached, otherwise at the last hop that
+        answered. A silent hop has ip and ms values None. Routers rate limit
+        ICMP errors; set rate_limiter to pace large traces."""
+        targets = self.resolve_many(hosts)
+        sock = self._trace_socket()
+        packet_id = self.packet_id
+        rate_limiter = self.rate_limiter
+        clock = self.perf_counter_ns
+        delays = [[[] for ttl in range(max_hops)] for t in targets] # ms per probe, None = lost
+        responders = [[None] * max_hops for t in targets]
+        reached = [max_hops + 1] * len(targets) # Lowest TTL the host answered at
+        try:
+            for probe in range(probes):
+                pending = {}
+                for ttl in range(1, max_hops + 1):
+                    sock.setsockopt(self.IPPROTO_IP, self.IP_TTL, ttl)
+                    for idx, (sHost, sIP) in enumerate(targets):
+                        if sIP == '0.0.0.0' or ttl > reached[idx]:
+                            continue
+                        sequence = self._next_sequence()
+                        packet = self._create_packet(packet_id, sequence)
+                        if rate_limiter is not None:
+                            rate_limiter.take()
+                        time_sent = clock()
+                        try:
+                            sock.sendto(packet, (sIP, 1)) # The icmp protocol does not use a port
+                        except self.error:
+                            delays[idx][ttl - 1].append(None)
+                            continue
+                        pending[(sIP, packet_id, sequence)] = (idx, ttl, time_sent)
+                deadline = self.time() + self.timeout
+                while pending:
+                    wait = deadline - self.time()
+                    if wait <= 0:
+                        break
+                    if self.select([sock], [], [], wait)[0] == []:
+                        continue
+                    for (idx, ttl, time_sent), hop_ip, time_received, final in self.__drain_trace(sock, pending):
+                        delays[idx][ttl - 1].append((time_received - time_sent) / 1e6)
+                        if responders[idx][ttl - 1] is None:
+                            responders[idx][ttl - 1] = hop_ip
+                        if final and ttl < reached[idx]:
+                            reached[idx] = ttl
+                for idx, ttl, time_sent in pending.values():
+                    delays[idx][ttl - 1].append(None)
+                if probe < probes - 1:
+                    self.sleep(0.1)
+        finally:
+            sock.close()
+        results = []
+        for idx, (sHost, sIP) in enumerate(targets):
+            if reached[idx] <= max_hops:
+                last = reached[idx]
+            else:
+                last = max([ttl for ttl in range(1, max_hops + 1) if responders[idx][ttl - 1]] or [0])
+            hops = []
+            for ttl in range(1, last + 1):
+                sent = len(delays[idx][ttl - 1])
+                replies = [d for d in delays[idx][ttl - 1] if d is not None]
+                hops.append({'ttl': ttl, 'ip': responders[idx][ttl - 1], 'sent': sent,
+                             'recieved': len(replies), 'lost': sent - len(replies),
+                             'losspercent': (sent - len(replies)) * 100 / sent if sent else 100.0,
+                             'min_ms': round(min(replies), 3) if replies else None,
+                             'average_ms': round(sum(replies) / len(replies), 3) if replies else None,
+                             'max_ms': round(max(replies), 3) if replies else None})
+            results.append({'host': sHost, 'ip': sIP, 'reached': reached[idx] <= max_hops, 'hops': hops})
+        return results
+
+class AsyncPyPing3(PyPing3):
+    """
+    Python3 asyncio ICMP Ping
+    -------------------------
+
+    Same results as PyPing3, but ping() is a coroutine and ping_many() is an
+    async generator. All pings share the non-blocking session socket registered
+    with the event loop's reader callbacks; replies resolve the waiting
+    future matched on (source ip, id, sequence). Name resolution runs in the
+    loop's default executor since the resolver itself is blocking.
+
+    Usage
+    -----
+
+    >>> p = AsyncPyPing3( ping_count=4, timeout=4 )
+    >>> res = await p.ping('google.com')
+    >>> async for res in p.ping_many(['google.com', '8.8.8.8']):
+    ...     print(res)
+    >>> p.close()
+    """
+
+    import asyncio
+
+    def __init__(self,ping_count=4,timeout=4,dns_cache=None,socket_mode='auto',adaptive=False,max_losses=0,transport=None,precise=False,metrics=None):
+        PyPing3.__init__(self,ping_count,timeout,dns_cache=dns_cache,socket_mode=socket_mode,adaptive=adaptive,max_losses=max_losses,transport=transport,precise=precise,metrics=metrics)
+        self.loop = None
+        self.waiters = {}
+
+    def __start(self):
+        """Registers the session socket with the running loop. When the instance
+        is used from a new loop (e.g. a second asyncio.run()), the reader moves
+        from the old loop to the new one and the old loop's waiters are dropped."""
+        loop = self.asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        if self.loop is not None and self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno()) # No-op once the old loop is closed
+        self.waiters = {}
+        sock = self._session_socket()
+        try:
+            sock.setsockopt(self.SOL_SOCKET, self.SO_RCVBUF, self.SWEEP_RCVBUF)
+        except self.error:
+            pass
+        self.loop = loop
+        loop.add_reader(sock.fileno(), self.__on_readable)
+
+    def close(self):
+        """Unregisters and closes the session socket."""
+        if self.loop is not None and self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+        self.loop = None
+        PyPing3.close(self)
+
+    def __on_readable(self):
+        """Reader callback: drains the socket and resolves matching futures."""
+        if self.metrics is not None:
+            self.metrics.count('select_wakeups')
+        for future, time_received, ttl in self._drain(self.sock, self.waiters):
+            if not future.done():
+                future.set_result((time_received, ttl))
+
+    async def __probe(self, sIP, packet_id, sequence):
+        """Sends one echo request and waits for its reply. Returns (delay, ttl), delay None on timeout."""
+        key = (sIP, packet_id, sequence)
+        future = self.loop.create_future()
+        self.waiters[key] = future
+        packet = self._create_packet(packet_id, sequence)
+        self.datasize = round(len(packet)/8)
+        metrics = self.metrics
+        time_sent = self.clock()
+        try:
+            self.sock.sendto(packet, (sIP, 1)) # The icmp protocol does not use a port
+        except self.error:
+            self.waiters.pop(key, None)
+            if metrics is not None:
+                metrics.count('send_errors')
+            return None, 0
+        if metrics is not None:
+            metrics.probe('sent', sIP, sequence)
+        try:
+            time_received, ttl = await self.asyncio.wait_for(future, self._probe_timeout(sIP))
+        except self.asyncio.TimeoutError:
+            if metrics is not None:
+                metrics.probe('timeout', sIP, sequence)
+            return None, 0
+        finally:
+            self.waiters.pop(key, None)
+        delay = (time_received - time_sent) / 1e9
+        if metrics is not None:
+            metrics.probe('reply', sIP, sequence, delay)
+        return delay, ttl
+
+    async def ping(self, host_or_ip_to_ping):
+        """ping(self, host_or_ip_to_ping)"""
+        if not self.can_ping():
+            print('Ping not possible: Insufficient privileges.')
+            return
+        self.__start()
+        start = self.perf_counter_ns()
+        sHost, sIP = await self.loop.run_in_executor(None, self._resolve, host_or_ip_to_ping)
+        if self.metrics is not None:
+            self.metrics.add_time('resolve', self.perf_counter_ns() - start)
+        delays = []
+        ttl = 0
+        if sIP != '0.0.0.0':
+            for probe in range(self.count):
+                if self._give_up(delays):
+                    delays.append(None)
+                    continue
+                delay, rec_ttl = await self.__probe(sIP, self.packet_id, self._next_sequence())
+                self._record(sIP, delay)
+                if delay is None:
+                    delays.append(None)
+                else:
+                    delays.append(self._delay_ms(delay)[0])
+                    ttl = rec_ttl
+                if probe < self.count-1:
+                    await self.asyncio.sleep(0.1)
+        return PingResult(*self._summary(sHost, sIP, delays, ttl))
+
+    async def ping_many(self, hosts, concurrency=1000):
+        """ping_many(self, hosts, concurrency=1000)
+
+        Async generator yielding one PingResult per host as soon as that
+        host completes. At most "concurrency" hosts are pinged at a time, and
+        "hosts" (any iterable, e.g. a generator over a huge file) is only read
+        as hosts complete."""
+        asyncio = self.asyncio
+        hosts = iter(hosts)
+        running = set()
+        try:
+            while True:
+                for host in hosts:
+                    running.add(asyncio.ensure_future(self.ping(host)))
+                    if len(running) >= concurrency:
+                        break
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in running:
+                task.cancel()
+
+class TokenBucket():
+    """
+    Packets per second limit shared by every process that holds this object
+    (pass it to the worker processes at creation). It is a GCRA: a theoretical
+    arrival time in shared memory that each caller advances. Up to "burst"
+    packets may go out at once after an idle period. Each process claims
+    "chunk" tokens per lock round-trip and spends them locally.
+    """
+
+    from time import monotonic, sleep
+
+    def __init__(self,rate,burst=None,chunk=16,context=None):
+        import multiprocessing
+        context = context or multiprocessing
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(rate / 10, chunk)
+        self.chunk = chunk
+        self.tat = context.Value('d', 0.0)
+        self.tokens = 0
+        self.due = 0.0 # Send time of the claimed chunk
+
+    def take(self):
+        """Blocks until one packet may be sent."""
+        wait = self.reserve() - self.monotonic()
+        if wait > 0:
+            self.sleep(wait)
+
+    def reserve(self):
+        """Claims one packet and returns the monotonic() time it may be sent at,
+        so the caller can do other work (read replies) until then."""
+        if self.tokens == 0:
+            with self.tat.get_lock():
+                now = self.monotonic()
+                start = max(self.tat.value, now - self.burst / self.rate)
+                self.tat.value = start + self.chunk / self.rate
+            self.due = start
+            self.tokens = self.chunk
+        self.tokens -= 1
+        return self.due
+
+def expand_targets(specs):
+    """Lazily expands host names, ip addresses and CIDR blocks ('10.0.0.0/16')
+    into single targets. Blank entries and '#' comments are skipped. Entries
+    with a '/' that are no CIDR block (e.g. a URL) are passed on as host names,
+    so they are reported as unresolved (ip 0.0.0.0) instead of ending the run."""
+    from ipaddress import ip_network
+    for spec in specs:
+        spec = spec.split('#', 1)[0].strip()
+        if not spec:
+            continue
+        if '/' in spec:
+            try:
+                network = ip_network(spec, strict=False)
+            except ValueError:
+                yield spec
+                continue
+            if network.num_addresses == 1:
+                yield str(network.network_address)
+            else:
+                for address in network.hosts():
+                    yield str(address)
+        else:
+            yield spec
+
+def target_file(path):
+    """Yields the lines of a host file one by one, for expand_targets()."""
+    with open(path) as file:
+        for line in file:
+            yield line
+
+_sweep_pinger = None
+
+def _sweep_worker_init(options, attributes, base_id, shard_counter, rate_limiter):
+    """Sweep worker process initializer: one PyPing3 (socket, id) per process."""
+    global _sweep_pinger
+    with shard_counter.get_lock():
+        shard = shard_counter.value
+        shard_counter.value += 1
+    _sweep_pinger = PyPing3(**options)
+    for name, value in attributes.items():
+        setattr(_sweep_pinger, name, value)
+    _sweep_pinger.rate_limiter = rate_limiter
+    if not _sweep_pinger.dgram: # Ping sockets get their id from the kernel
+        _sweep_pinger.close()
+        _sweep_pinger.packet_id = (base_id + shard) & 0xffff
+    _sweep_pinger.can_ping()
+
+def _sweep_worker_chunk(hosts):
+    if not _sweep_pinger.can_ping(): # ping_many() would only print a message and return None
+        raise PermissionError('Ping not possible: insufficient privileges to open an ICMP socket.')
+    return _sweep_pinger.ping_many(hosts)
+
+class SweepRunner():
+    """
+    Multi-process sweep of large target lists on top of PyPing3.
+
+    Targets (host names, ips, CIDR blocks) are expanded lazily and cut into
+    chunks of "chunk_size". Chunks are pinged by a pool of worker processes,
+    each with its own PyPing3 session: its own socket and echo id. A shared
+    TokenBucket caps the total packets per second at "rate" across all
+    workers. run() yields PingResult rows in target order. At most two chunks
+    per worker are in flight, so memory stays bounded for any number of
+    targets.
+
+    >>> runner = SweepRunner( processes=4, rate=20000, ping_count=1, timeout=1 )
+    >>> for res in runner.run(['10.0.0.0/16', 'google.com']):
+    ...     print(res['ip'], res['recieved'])
+    """
+
+    def __init__(self,processes=None,rate=None,burst=None,chunk_size=1024,reverse_dns=False,**ping_options):
+        import multiprocessing
+        self.context = multiprocessing.get_context()
+        self.processes = processes or self.context.cpu_count()
+        self.rate_limiter = TokenBucket(rate, burst, context=self.context) if rate else None
+        self.chunk_size = chunk_size
+        self.ping_options = ping_options
+        self.attributes = {'reverse_dns': reverse_dns}
+        self.base_id = int(PyPing3.random() * 65535)
+
+    def __chunks(self, targets):
+        chunk = []
+        for target in expand_targets(targets):
+            chunk.append(target)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(self, targets):
+        """Generator of PingResult rows for "targets", in target order. Raises
+        PermissionError when the workers cannot open an ICMP socket."""
+        from collections import deque
+        shard_counter = self.context.Value('i', 0)
+        initargs = (self.ping_options, self.attributes, self.base_id, shard_counter, self.rate_limiter)
+        with self.context.Pool(self.processes, _sweep_worker_init, initargs) as pool:
+            in_flight = deque()
+            for chunk in self.__chunks(targets):
+                in_flight.append(pool.apply_async(_sweep_worker_chunk, (chunk,)))
+                if len(in_flight) >= 2 * self.processes:
+                    yield from in_flight.popleft().get()
+            while in_flight:
+                yield from in_flight.popleft().get()
+
+class FakeICMPResponder():
+    """
+    In-process simulated network, used as PyPing3(transport=FakeICMPResponder(...))
+    to test and benchmark the ping engine without root or a real network.
+
+    Every echo request is answered by the destination ip after "latency" seconds,
+    either a number or a callable returning seconds per reply, e.g.
+    lambda: random.gauss(0.002, 0.0005). "hops" is the path length, for all
+    hosts or per ip as a dict: probes whose TTL runs out get a time exceeded
+    from router 100.64.<ttl>.1 after a share of the latency, for traceroute().
+    "loss", "duplicate" and "reorder" are
+    probabilities per request; a reordered reply is held back "reorder_delay"
+    seconds longer. "noise" stray ICMP packets (foreign echo replies and
+    destination unreachables) are injected per request. "hosts" limits the ips
+    that answer (None: all). Counters: requests, replies, dropped, duplicates,
+    stray, plus delivered and late_s, the total seconds packets went out behind
+    schedule (the delivery thread competes with the engine for the GIL).
+
+    >>> fake = FakeICMPResponder( latency=0.002, loss=0.1, noise=2 )
+    >>> p = PyPing3( ping_count=1, timeout=1, transport=fake )
+    """
+
+    import random
+    from struct import pack
+    from socket import inet_aton
+
+    def __init__(self,latency=0.001,loss=0.0,duplicate=0.0,reorder=0.0,reorder_delay=0.005,noise=0,hosts=None,ttl=64,hops=1,seed=None):
+        self.latency = latency
+        self.hops = hops
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.noise = noise
+        self.hosts = set(hosts) if hosts is not None else None
+        self.ttl = ttl
+        self.rng = self.random.Random(seed)
+        self.requests = 0
+        self.replies = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.stray = 0
+        self.delivered = 0
+        self.late_s = 0.0
+
+    def open(self):
+        """Returns a new socket-like endpoint (the PyPing3 transport interface)."""
+        return FakeICMPSocket(self)
+
+    def __delay(self):
+        if callable(self.latency):
+            return max(0.0, self.latency())
+        return self.latency
+
+    def __ip_header(self, src, length, dest='127.0.0.1', ttl=None):
+        return self.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + length, 0, 0, self.ttl if ttl is None else ttl, 1, 0,
+                         self.inet_aton(src), self.inet_aton(dest))
+
+    def __time_exceeded(self, router, dest, request):
+        """Time exceeded from "router", quoting the request's IP header and first 8 bytes."""
+        quote = self.__ip_header('127.0.0.1', len(request), dest, 1) + request[:8]
+        total = int.from_bytes(self.pack('!BBHI', 11, 0, 0, 0) + quote, 'little') % 0xffff
+        icmp = self.pack('!BB', 11, 0) + (~total & 0xffff).to_bytes(2, 'little') + bytes(4) + quote
+        return self.__ip_header(router, len(icmp)) + icmp
+
+    def __reply(self, src, request):
+        """Echo reply for "request": type 8 -> 0 with the checksum adjusted
+        incrementally (RFC 1624), behind an IP header from "src"."""
+        checksum = int.from_bytes(request[2:4], 'little')
+        total = (~checksum & 0xffff) + 0xfff7 # HC' = ~(~HC + ~m + m'), m = 8, m' = 0
+        checksum = ~((total & 0xffff) + (total >> 16)) & 0xffff
+        reply = b'\x00\x00' + checksum.to_bytes(2, 'little') + request[4:]
+        return self.__ip_header(src, len(reply)) + reply
+
+    def __stray(self):
+        """A packet the session must ignore: another process' echo reply, or a
+        destination unreachable from some router."""
+        rng = self.rng
+        src = '10.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(1, 255))
+        if rng.random() < 0.5:
+            icmp = self.pack('!BBHHH', 0, 0, 0, rng.randrange(65536), rng.randrange(65536)) + 32 * b'x'
+        else:
+            icmp = self.pack('!BBHI', 3, 1, 0, 0) + 28 * b'\x00'
+        return src, self.__ip_header(src, len(icmp)) + icmp
+
+    def respond(self, sock, request, dest):
+        """Schedules what the network returns for one echo request on "sock"."""
+        self.requests += 1
+        rng = self.rng
+        for n in range(self.noise):
+            self.stray += 1
+            src, packet = self.__stray()
+            sock.deliver(rng.random() * 0.001, src, packet)
+        if len(request) < 8 or request[0] != 8:
+            return
+        if (self.hosts is not None and dest not in self.hosts) or rng.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.__delay()
+        if rng.random() < self.reorder:
+            delay += self.reorder_delay
+        hops = self.hops.get(dest, 1) if isinstance(self.hops, dict) else self.hops
+        if sock.ttl < hops:
+            sock.deliver(delay * sock.ttl / hops, None, self.__time_exceeded('100.64.%d.1' % sock.ttl, dest, request))
+            return
+        reply = self.__reply(dest, request)
+        self.replies += 1
+        sock.deliver(delay, dest, reply)
+        if rng.random() < self.duplicate:
+            self.duplicates += 1
+            sock.deliver(delay + rng.random() * 0.001, dest, reply)
+
+class FakeICMPSocket():
+    """
+    Socket-like end of a FakeICMPResponder with raw ICMP socket semantics
+    (received packets start with an IP header). Replies travel over a local
+    datagram socketpair, so select() and asyncio readers work on fileno().
+    A daemon thread sends each reply when it is due.
+    """
+
+    import heapq
+    import socket
+    from socket import inet_ntoa, AF_UNIX, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF, SO_SNDBUF, IPPROTO_IP, IP_TTL
+    SO_TIMESTAMPNS = 35 # Linux, supported by unix sockets too
+    from threading import Thread, Condition
+    from time import time
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.app, self.net = self.socket.socketpair(self.AF_UNIX, self.SOCK_DGRAM)
+        self.app.setsockopt(self.SOL_SOCKET, self.SO_RCVBUF, 4 * 1024 * 1024)
+        self.net.setsockopt(self.SOL_SOCKET, self.SO_SNDBUF, 4 * 1024 * 1024)
+        self.ttl = 64 # IP_TTL of outgoing requests
+        self.queue = [] # Heap of (due, n, packet)
+        self.counter = 0
+        self.closed = False
+        self.ready = self.Condition()
+        self.thread = self.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def deliver(self, delay, src, packet):
+        """Queues "packet" (IP header included) to arrive after "delay" seconds."""
+        with self.ready:
+            self.counter += 1
+            self.heapq.heappush(self.queue, (self.time() + delay, self.counter, packet))
+            if self.queue[0][1] == self.counter:
+                self.ready.notify()
+
+    def __run(self):
+        queue = self.queue
+        while True:
+            with self.ready:
+                while not self.closed and (not queue or queue[0][0] > self.time()):
+                    self.ready.wait(queue[0][0] - self.time() if queue else None)
+                if self.closed:
+                    return
+                now = self.time()
+                due = []
+                while queue and queue[0][0] <= now:
+                    due.append(self.heapq.heappop(queue))
+            responder = self.responder
+            for when, n, packet in due:
+                try:
+                    self.net.send(packet)
+                except OSError:
+                    return
+                responder.late_s += self.time() - when
+            responder.delivered += len(due)
+
+    def sendto(self, packet, address):
+        self.responder.respond(self, bytes(packet), address[0])
+        return len(packet)
+
+    def recvfrom_into(self, buffer, nbytes=0, flags=0):
+        size = self.app.recv_into(buffer, nbytes, flags)
+        return size, (self.inet_ntoa(bytes(buffer[12:16])), 0)
+
+    def recvmsg_into(self, buffers, ancbufsize=0, flags=0):
+        nbytes, ancdata, msg_flags, addr = self.app.recvmsg_into(buffers, ancbufsize, flags)
+        return nbytes, ancdata, msg_flags, (self.inet_ntoa(bytes(buffers[0][12:16])), 0)
+
+    def recvfrom(self, bufsize, flags=0):
+        packet = self.app.recv(bufsize, flags)
+        return packet, (self.inet_ntoa(packet[12:16]), 0)
+
+    def fileno(self):
+        return self.app.fileno()
+
+    def setblocking(self, flag):
+        self.app.setblocking(flag)
+
+    def settimeout(self, value):
+        self.app.settimeout(value)
+
+    def setsockopt(self, level, option, value):
+        if level == self.SOL_SOCKET and option == self.SO_TIMESTAMPNS:
+            self.app.setsockopt(level, option, value) # Delivery time of each reply
+        elif level == self.IPPROTO_IP and option == self.IP_TTL:
+            self.ttl = value
+        # Socket filters and buffer sizes do not apply
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.app.close()
+        self.net.close()
+
+def benchmark_engine(hosts=2000, rounds=5, latency=0.002):
+    """Ping engine benchmark against FakeICMPResponder (no root or network).
+    Reports probes/s, CPU per probe (process CPU, so it includes the responder
+    thread) and the RTT measurement error against the fixed responder latency,
+    with user space and (precise mode) kernel receive timestamps.
+    A second run adds loss, duplicates, reordering and stray ICMP noise and
+    compares the measured loss with the configured one."""
+    from time import perf_counter, process_time
+    targets = ['10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255) for n in range(1, hosts + 1)]
+    results = {}
+    for name, precise, fake in (('clean', False, FakeICMPResponder(latency=latency, seed=1)),
+                                ('clean, precise', True, FakeICMPResponder(latency=latency, seed=1)),
+                                ('lossy/dup/reorder/noise', False, FakeICMPResponder(latency=latency, loss=0.1, duplicate=0.05,
+                                                                                     reorder=0.1, noise=2, seed=1))):
+        p = PyPing3(ping_count=1, timeout=1, transport=fake, precise=precise)
+        p.reverse_dns = False
+        errors = []
+        start, cpu = perf_counter(), process_time()
+        for res in p.monitor(targets, interval=0, rounds=rounds):
+            if res['rtt_ms'] is not None:
+                errors.append(res['rtt_ms'] - latency * 1000)
+        wall, cpu = perf_counter() - start, process_time() - cpu
+        p.close()
+        probes = hosts * rounds
+        errors.sort()
+        results[name] = stats = {'probes_per_s': probes / wall,
+                                 'cpu_us_per_probe': cpu * 1e6 / probes,
+                                 'rtt_error_ms_p50': errors[len(errors) // 2] if errors else None,
+                                 'rtt_error_ms_p99': errors[len(errors) * 99 // 100] if errors else None,
+                                 'responder_late_ms': fake.late_s * 1000 / max(fake.delivered, 1),
+                                 'loss_measured': 1 - len(errors) / probes,
+                                 'loss_configured': fake.loss}
+        print('{:<26}{:>10.0f} probes/s {:>8.1f} us cpu/probe  rtt error p50 {:.3f} ms p99 {:.3f} ms'
+              ' (responder late {:.3f} ms)  loss {:.3f} (configured {:.3f})'.format(
+            name, stats['probes_per_s'], stats['cpu_us_per_probe'], stats['rtt_error_ms_p50'],
+            stats['rtt_error_ms_p99'], stats['responder_late_ms'], stats['loss_measured'], stats['loss_configured']))
+    return results
+
+def benchmark_packets(packets=20000):
+    """Micro-benchmark: echo request construction with the original byte-pair
+    checksum loop versus PyPing3's template/incremental packet builder."""
+    from struct import pack
+    from socket import htons
+    from time import perf_counter
+
+    def legacy_checksum(source_string):
+        checksum = 0
+        count_to = (len(source_string) // 2) * 2
+        count = 0
+        while count < count_to:
+            checksum += source_string[count + 1] * 256 + source_string[count]
+            checksum &= 0xffffffff
+            count += 2
+        checksum = (checksum >> 16) + (checksum & 0xffff)
+        checksum += checksum >> 16
+        answer = ~checksum & 0xffff
+        return answer >> 8 | (answer << 8 & 0xff00)
+
+    def legacy_packet(id, sequence):
+        header = pack('bbHHH', 8, 0, 0, id, sequence)
+        data = 192 * b'Q'
+        header = pack('bbHHH', 8, 0, htons(legacy_checksum(header + data)), id, sequence)
+        return header + data
+
+    p = PyPing3(transport=FakeICMPResponder()) # Builds packets only, no ICMP socket or privileges needed
+    payload = bytes(range(256)) * 6
+    results = []
+    try:
+        for name, func in (('legacy packet build', legacy_packet), ('template packet build', p._create_packet)):
+            start = perf_counter()
+            for n in range(packets):
+                func(n & 0xffff, n & 0xffff)
+            results.append((name, perf_counter() - start))
+        for name, func in (('legacy checksum 1536 bytes', legacy_checksum), ('checksum 1536 bytes', p.checksum)):
+            start = perf_counter()
+            for n in range(packets):
+                func(payload)
+            results.append((name, perf_counter() - start))
+    finally:
+        p.close()
+    for name, seconds in results:
+        print('{:<28}{:>10.2f} us/op {:>12.0f} ops/s'.format(name, seconds * 1e6 / packets, packets / seconds))
+    return results
+
+def main(argv=None):
+    """Command line entry point. Pings targets (host names, ips, CIDR blocks)
+    from the arguments, -f files and/or stdin, and writes one JSON line per
+    host to stdout as soon as that host completes. Targets are read lazily and
+    stdout is block buffered (no flush per line), so it scales to large runs
+    in a pipeline. Without targets on a terminal, pings 127.0.0.1 and the
+    primary ip verbosely. Exits with status 2 when no ICMP socket can be opened."""
+    import argparse, sys, io, contextlib
+    parser = argparse.ArgumentParser(prog='pyping3.py', description='Bulk ICMP ping, one JSON object per host on stdout.')
+    parser.add_argument('targets', nargs='*', help="host names, ip addresses or CIDR blocks, '-' reads stdin")
+    parser.add_argument('-f', '--file', action='append', default=[], help="file with one target per line, '-' for stdin")
+    parser.add_argument('-c', '--count', type=int, default=1, help='echo requests per host (default 1)')
+    parser.add_argument('-W', '--timeout', type=float, default=1, help='seconds to wait for a reply (default 1)')
+    parser.add_argument('-n', '--concurrency', type=int, default=1000, help='hosts in flight (default 1000)')
+    parser.add_argument('-P', '--processes', type=int, default=0, help='sweep with N worker processes, results in input order')
+    parser.add_argument('--rate', type=float, help='packets per second limit (uses the process sweeper)')
+    parser.add_argument('--socket-mode', choices=('auto', 'dgram', 'raw'), default='auto')
+    parser.add_argument('--adaptive', action='store_true', help='per host timeouts from the measured RTT')
+    parser.add_argument('--max-losses', type=int, default=0, help='stop probing a silent host after N losses')
+    parser.add_argument('--precise', action='store_true', help='fractional ms, kernel receive timestamps')
+    parser.add_argument('--reverse-dns', action='store_true', help='look up host names of ip targets')
+    parser.add_argument('--bench', action='store_true', help='run the benchmarks and exit')
+    args = parser.parse_args(argv)
+    if args.bench:
+        benchmark_packets()
+        benchmark_engine()
+        return 0
+    with contextlib.redirect_stdout(io.StringIO()): # The constructor reports missing privileges on stdout
+        checker = PyPing3(socket_mode=args.socket_mode)
+    try:
+        checker._session_socket()
+    except OSError as error: # Keep the JSON lines on stdout clean
+        print('pyping3.py: ping not possible:', error, file=sys.stderr)
+        return 2
+    finally:
+        checker.close()
+    if not args.targets and not args.file and sys.stdin.isatty():
+        p = PyPing3()
+        local_ip = p.get_primary_ip()
+        ping_addr = ['127.0.0.1',local_ip]
+        for addr in ping_addr:
+            p.ping(addr,verbose=True)
+        return 0
+
+    def specs():
+        for name in args.file:
+            yield from sys.stdin if name == '-' else target_file(name)
+        for target in args.targets:
+            if target == '-':
+                yield from sys.stdin
+            else:
+                yield target
+        if not args.targets and not args.file:
+            yield from sys.stdin
+
+    options = {'ping_count': args.count, 'timeout': args.timeout, 'socket_mode': args.socket_mode,
+               'adaptive': args.adaptive, 'max_losses': args.max_losses, 'precise': args.precise}
+    out = open(sys.stdout.fileno(), 'w', buffering=1 << 16, closefd=False)
+    try:
+        if args.processes or args.rate:
+            runner = SweepRunner(processes=args.processes or None, rate=args.rate, chunk_size=args.concurrency,
+                                 reverse_dns=args.reverse_dns, **options)
+            for res in runner.run(specs()):
+                out.write(res.jsonl())
+        else:
+            import asyncio
+            async def run():
+                p = AsyncPyPing3(**options)
+                p.reverse_dns = args.reverse_dns
+                try:
+                    async for res in p.ping_many(expand_targets(specs()), args.concurrency):
+                        if res is not None:
+                            out.write(res.jsonl())
+                finally:
+                    p.close()
+            asyncio.run(run())
+        out.flush()
+    except BrokenPipeError: # Output closed early, e.g. by head
+        sys.stderr.close()
+        return 1
+    except KeyboardInterrupt:
+        out.flush()
+        return 130
+    return 0
 
 if __name__ == '__main__':
-    p = PyPing3()
-    local_ip = p.get_primary_ip()
-    ping_addr = ['127.0.0.1',local_ip]
-    for addr in ping_addr:
-        p.ping(addr,verbose=True)
+    import sys
+    sys.exit(main())
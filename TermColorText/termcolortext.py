@@ -6,9 +6,14 @@
 #-------------------------------------------------------------------------------
 # Revision:
 # 22-09-2016 : Added get_visual_screen_size(), clear_line()
+# 18-10-2026 : print()/printxy() write each line at once, cached styles, frame()
+# 18-10-2026 : Added TermScreen, double-buffered cells with diff-based refresh()
+# 18-10-2026 : Cached screen size (TIOCGWINSZ + SIGWINCH), cursor tracked in software
+# 18-10-2026 : Optional background writer thread: start_writer(), flush(), stop_writer()
+# 18-10-2026 : Added TermTable, escape/wide-char aware columns with virtual scrolling
 #-------------------------------------------------------------------------------
 # Requirements:
-# Python 3.5.x (developed in Python 3.5.1)
+# Python 3.7+ (developed in Python 3.5.1; TermTable uses str.isascii())
 # ctype  # Core Python3
 # struct # Core Python3
 #-------------------------------------------------------------------------------
@@ -16,12 +21,36 @@
 # tct = TermColorText('[ Terminal Color Text ]')
 # tct.print('This','is','a','Test',3.1415,FG='green')
 # tct.print('This','is','a','Test',3.1415,FG='white',BG='cyan',bold=True)
+# with tct.frame():
+#     tct.printxy(1,1,'Host',FG='yellow')
+#     tct.printxy(1,2,'8.8.8.8',FG='green')
 #-------------------------------------------------------------------------------
+_resize_watchers = None # WeakSet of TermColorText instances, see watch_screen_size()
+_resize_previous = None # SIGWINCH handler installed before ours
+
+def _on_resize(signum,frame):
+    for tct in list(_resize_watchers):
+        tct.size_dirty = True
+    if callable(_resize_previous): _resize_previous(signum,frame)
+
 class TermColorText():
     """Simple Cross Platform (Windows, Linux, Darwin) Terminal/DOS-Prompt Text Color Class."""
     def __init__(self,terminal_title='',windows_terminal_color=''):
         
         from platform import system as os_type
+        from sys import stdout
+        self.out = stdout
+        self.segments = [] # Output not written yet: (attribute or None, text)
+        self.frame_depth = 0
+        self.frame_key = None # Status line key of the open frame, for backpressure='collapse'
+        self.writer = None # Background writer thread, see start_writer()
+        self.styles = {} # (FG, BG, bold) -> SGR sequence or Windows attribute
+        self.screen_size = None # Cached (columns, rows)
+        self.size_dirty = True
+        self.size_checked = 0.0
+        self.watching_size = False
+        self.cursor_x = 1 # Tracked after our own output, 1-based
+        self.cursor_y = 1
         self.win_terminal_color = windows_terminal_color
         self.terminal_title = terminal_title
         self.os_type = os_type()
@@ -34,6 +63,7 @@ class TermColorText():
         self.beep = '\007'
         self.esc  = '\x1b['
         self.end  = '\x1b[0;0m'
+        self.GOTO = -1 # Windows segment: cursor position instead of text
         self.attrib  = {'reset': '0m','bright': '1m','bold': '1m','dim': '2m','italic': '3m','underscore': '4m','blink': '5m','blink2': '6m','reverse': '7m','hidden': '8m'}
         self.ansi_fg = {'black': '30m','red': '31m','green': '32m','yellow': '33m','blue': '34m','magenta': '35m','cyan': '36m','white': '37m','grey': '37m','default': '39m'}
         self.ansi_bg = {'black': '40m','red': '41m','green': '42m','yellow': '43m','blue': '44m','magenta': '45m','cyan': '46m','white': '47m','grey': '47m','default': '49m'}
@@ -81,7 +111,12 @@ class TermColorText():
             self.FillConsoleOutputCharacterA = windll.kernel32.FillConsoleOutputCharacterA
             self.FillConsoleOutputAttribute = windll.kernel32.FillConsoleOutputAttribute
             
+            from time import monotonic
+            self.monotonic = monotonic
+            self.SIZE_CHECK_INTERVAL = 0.25 # Seconds a cached size is trusted
+
             self.init_screen_size = self.get_visual_screen_size()
+            self.sync_cursor()
             
             self.default_colors = self.get_text_attr()
             self.default_fc = list(self.win_fg.keys())[list(self.win_fg.values()).index(self.default_colors & 0x07)]
@@ -89,9 +124,37 @@ class TermColorText():
             
             self.set_win_terminal_color(self.win_terminal_color)
             
+        else: # Init Linux, Darwin
+            from fcntl import ioctl
+            from termios import TIOCGWINSZ
+            from struct import unpack
+            self.ioctl = ioctl
+            self.TIOCGWINSZ = TIOCGWINSZ
+            self.unpack = unpack
+            self.watch_screen_size()
+
         self.set_terminal_title()
-        
-    def get_visual_screen_size(self):
+
+    def watch_screen_size(self):
+        """Marks the cached screen size stale on SIGWINCH (POSIX, main thread only;
+        elsewhere every get_visual_screen_size() queries the terminal). One module
+        level handler serves all instances, held weakly so they can be freed."""
+        global _resize_watchers, _resize_previous
+        try:
+            from signal import signal, getsignal, SIGWINCH
+            from weakref import WeakSet
+            if _resize_watchers is None:
+                previous = getsignal(SIGWINCH)
+                signal(SIGWINCH,_on_resize)
+                _resize_previous = previous
+                _resize_watchers = WeakSet()
+            _resize_watchers.add(self)
+            self.watching_size = True
+        except (ImportError,ValueError,OSError):
+            self.watching_size = False
+
+    def query_screen_size(self):
+        """Asks the console (Windows) or the terminal (ioctl TIOCGWINSZ) for its size."""
         if self.os_type == 'Windows':
             if self.GetConsoleScreenBufferInfo(self.std_out_handle,self.csbi_byref):
                 (bufx, bufy, curx, cury, wattr, left, top, right, bottom, maxx, maxy) = self.unpack("hhhhHhhhhhh", self.csbi)
@@ -100,8 +163,27 @@ class TermColorText():
                 return sizex, sizey
             else:
                 return 0,0
-        else:
+        try:
+            rows, cols = self.unpack('HHHH',self.ioctl(self.out.fileno(),self.TIOCGWINSZ,bytes(8)))[:2]
+            if cols and rows:
+                return cols, rows
+        except (OSError,ValueError,AttributeError): # Not a terminal
             pass
+        from shutil import get_terminal_size # $COLUMNS/$LINES or 80x24
+        return tuple(get_terminal_size())
+
+    def get_visual_screen_size(self):
+        """Returns (columns, rows) from the cache. It is refreshed after SIGWINCH on
+        POSIX and at most every SIZE_CHECK_INTERVAL seconds on Windows."""
+        if self.os_type == 'Windows':
+            now = self.monotonic()
+            if self.screen_size is None or now-self.size_checked >= self.SIZE_CHECK_INTERVAL:
+                self.size_checked = now
+                self.screen_size = self.query_screen_size()
+        elif self.size_dirty or not self.watching_size:
+            self.size_dirty = False # Before the query, so a resize during it is not lost
+            self.screen_size = self.query_screen_size()
+        return self.screen_size
         
     def clear_line(self,y):
         if self.os_type == 'Windows':
@@ -110,9 +192,13 @@ class TermColorText():
             self.gotoxy(1,y)
             self.print(clrstr)
             self.gotoxy(1,y)
+        else:
+            self.gotoxy(1,y)
+            self.write('\x1b[2K')
 
     def clear_screen(self):
         if self.os_type == 'Windows':
+            self.flush() # Console calls bypass the writer queue
             clear_start = self._COORD(0,0)
             clear_length = self.csbi.dwSize.X * self.csbi.dwSize.Y
             self.SetConsoleCursorPosition(self.std_out_handle, clear_start)
@@ -122,21 +208,22 @@ class TermColorText():
             self.SetConsoleCursorPosition(self.std_out_handle, clear_start)
             print('',end='',flush=True) # Not really needed.
         else:
-            print('\x1b[2J\x1b[H',flush=True)
+            self.write('\x1b[2J\x1b[H')
+        self.cursor_x = self.cursor_y = 1
             
     def show_cursor(self):
         if self.os_type == 'Windows':
             self.cci.bVisible = True
             self.SetConsoleCursorInfo(self.std_out_handle,self.cci_byref)
         else:
-            print('\x1b[?25h',flush=True)
+            self.write('\x1b[?25h')
         
     def hide_cursor(self):
         if self.os_type == 'Windows':
             self.cci.bVisible = False
             self.SetConsoleCursorInfo(self.std_out_handle,self.cci_byref)
         else:
-            print('\x1b[?25l',flush=True)
+            self.write('\x1b[?25l')
 
     def set_win_terminal_color(self,color):
         from os import system
@@ -151,7 +238,7 @@ class TermColorText():
             if self.os_type == 'Windows':
                 system('title '+titletxt)
             else:
-                print('\x1b]0;'+titletxt+'\x07',flush=True) #\x1b]2;
+                self.write('\x1b]0;'+titletxt+'\x07') #\x1b]2;
                     
     def get_text_attr(self): # Windows
         if self.os_type == 'Windows':
@@ -163,69 +250,575 @@ class TermColorText():
             return self.SetConsoleTextAttribute(self.std_out_handle,color)
         
     def get_cursor_xy(self):
+        """Returns the cursor position as tracked after this object's own output (no console query)."""
+        return self.cursor_x, self.cursor_y
+
+    def sync_cursor(self): # Windows
+        """Reads the real cursor position, e.g. after output that bypassed this object."""
         if self.os_type == 'Windows':
             self.GetConsoleScreenBufferInfo(self.std_out_handle,self.csbi_byref)
-            x = self.csbi.dwCursorPosition.X + 1
-            y = self.csbi.dwCursorPosition.Y + 1
-            return x, y
-        else:
-            pass
+            self.cursor_x = self.csbi.dwCursorPosition.X + 1
+            self.cursor_y = self.csbi.dwCursorPosition.Y + 1
+        return self.cursor_x, self.cursor_y
+
+    def advance_cursor(self,text,newline=False):
+        """Moves the tracked cursor over printed "text" (no escape sequences), wrapping at the screen width."""
+        cols, rows = self.get_visual_screen_size()
+        x = self.cursor_x + len(text)
+        y = self.cursor_y
+        if cols and x > cols:
+            y += (x-2)//cols
+            x = (x-2)%cols + 2
+        if newline:
+            x = 1
+            y += 1
+        self.cursor_x = x
+        self.cursor_y = min(y,rows) if rows else y # The terminal scrolls at the bottom
     
     def gotoxy(self,x=1,y=1):
         if x <= 0: x = 1
         if y <= 0: y = 1
         if self.os_type == 'Windows':
             #new_pos = self._COORD(min(max(0, self.csbi.dwCursorPosition.X + x_offset),self.csbi.dwSize.X), min(max(0, self.csbi.dwCursorPosition.Y + y_offset),self.csbi.dwSize.Y))
-            new_pos = self._COORD(x-1,y-1)
-            self.SetConsoleCursorPosition(self.std_out_handle,new_pos)
+            self.write(self._COORD(x-1,y-1),self.GOTO)
         else:
-            print('\033['+str(x)+'x;'+str(y)+'H',flush=True)
-    
+            self.write(self.esc+str(y)+';'+str(x)+'H')
+        self.cursor_x = x
+        self.cursor_y = y
+
+    def get_style(self,FG=None,BG=None,bold=False):
+        """Returns the cached style for (FG, BG, bold): the SGR escape sequence, or the console attribute on Windows."""
+        style = self.styles.get((FG,BG,bold))
+        if style is None:
+            if self.os_type == 'Windows':
+                fc = str(FG or self.default_fc).lower().strip()
+                bc = str(BG or self.default_bc).lower().strip()
+                style = self.win_fg.get(fc,self.win_fg[self.default_fc]) | self.win_bg.get(bc,self.win_bg[self.default_bc])
+                if bold: style |= self.win_fg['bold']
+            else: # Linux, Darwin
+                fc = str(FG or 'default').lower().strip()
+                bc = str(BG or 'default').lower().strip()
+                if not fc in self.ansi_fg: fc = 'default'
+                if not bc in self.ansi_bg: bc = 'default'
+                # Starts with a reset, so styles can follow each other without self.end in between
+                style = self.esc+'0;'+(self.attrib['bold'][:-1]+';' if bold else '')+self.ansi_fg[fc][:-1]+';'+self.ansi_bg[bc]
+            self.styles[(FG,BG,bold)] = style
+        return style
+
+    def write(self,text,attr=None):
+        """Queues raw "text" (with Windows console attribute "attr") and writes it unless a frame is open."""
+        self.segments.append((attr,text))
+        if not self.frame_depth:
+            self.flush_frame()
+
+    def flush_frame(self):
+        """Writes the queued output, or hands it to the background writer when one is running."""
+        segments = self.segments
+        if not segments:
+            return
+        self.segments = []
+        if self.writer is None:
+            self.write_segments(segments)
+        else:
+            self.enqueue_frame(self.frame_key,segments)
+
+    def write_segments(self,segments):
+        """Writes (attr, text) segments: one write and flush on ANSI terminals, one per style run on Windows."""
+        if self.os_type == 'Windows':
+            current = None
+            for attr, text in segments:
+                if attr == self.GOTO:
+                    self.out.flush()
+                    self.SetConsoleCursorPosition(self.std_out_handle,text)
+                    continue
+                if attr != current:
+                    self.out.flush()
+                    self.set_text_color(self.default_colors if attr is None else attr)
+                    current = attr
+                self.out.write(text)
+            self.out.flush()
+            if current is not None:
+                self.set_text_color(self.default_colors)
+        else:
+            self.out.write(''.join([text for attr, text in segments]))
+            self.out.flush()
+
+    def frame(self,key=None):
+        """Context manager (batch) deferring all output until the outermost frame ends:
+
+        with tct.frame():
+            tct.printxy(1,1,'Host',FG='yellow')
+            tct.printxy(1,2,'8.8.8.8',FG='green')
+
+        "key" names a status line: with the 'collapse' writer a queued frame is
+        replaced by a newer frame with the same key."""
+        from contextlib import contextmanager
+        @contextmanager
+        def frame():
+            if not self.frame_depth:
+                self.frame_key = key
+            self.frame_depth += 1
+            try:
+                yield self
+            finally:
+                self.frame_depth -= 1
+                if not self.frame_depth:
+                    self.flush_frame()
+                    self.frame_key = None
+        return frame()
+
+    def start_writer(self,max_frames=1024,backpressure='block'):
+        """Switches to asynchronous output: frames are queued (at most "max_frames")
+        and a writer thread writes everything queued at once, so callers do not wait
+        for a slow terminal or a full pipe. When the queue is full, "backpressure"
+        decides: 'block' waits for room, 'drop-oldest' discards the oldest frame,
+        'collapse' replaces a queued frame with the same key (printxy() frames
+        are keyed by position, others by frame(key=...)) and otherwise blocks."""
+        from threading import Thread, Condition
+        from collections import deque
+        import atexit
+        if backpressure not in ('block','drop-oldest','collapse'):
+            raise ValueError('backpressure must be block, drop-oldest or collapse')
+        if self.writer is not None:
+            return
+        self.flush_frame()
+        self.queue = deque() # [key, segments] per frame
+        self.queue_keys = {}
+        self.queue_ready = Condition()
+        self.max_frames = max(1,max_frames)
+        self.backpressure = backpressure
+        self.writing = False
+        self.writer_stop = False
+        self.writer_error = None
+        self.dropped_frames = 0
+        self.collapsed_frames = 0
+        self.writer = Thread(target=self.writer_loop,name='TermColorText writer',daemon=True)
+        self.writer.start()
+        atexit.register(self.stop_writer)
+
+    def enqueue_frame(self,key,segments):
+        """Queues one frame for the writer thread, applying the backpressure policy."""
+        with self.queue_ready:
+            if key is not None and self.backpressure == 'collapse':
+                item = self.queue_keys.get(key)
+                if item is not None:
+                    item[1] = segments
+                    self.collapsed_frames += 1
+                    return
+            while len(self.queue) >= self.max_frames:
+                if self.backpressure == 'drop-oldest':
+                    old_key, old_segments = self.queue.popleft()
+                    self.queue_keys.pop(old_key,None)
+                    self.dropped_frames += 1
+                else:
+                    self.queue_ready.wait()
+            item = [key,segments]
+            self.queue.append(item)
+            if key is not None:
+                self.queue_keys[key] = item
+            self.queue_ready.notify_all()
+
+    def writer_loop(self):
+        while True:
+            with self.queue_ready:
+                while not self.queue and not self.writer_stop:
+                    self.queue_ready.wait()
+                if not self.queue:
+                    return
+                items = list(self.queue)
+                self.queue.clear()
+                self.queue_keys.clear()
+                self.writing = True
+                self.queue_ready.notify_all() # Room for blocked callers
+            try:
+                if self.writer_error is None:
+                    self.write_segments([segment for key, segments in items for segment in segments])
+            except Exception as exc: # e.g. BrokenPipeError, raised again by flush()
+                self.writer_error = exc
+            with self.queue_ready:
+                self.writing = False
+                self.queue_ready.notify_all()
+
+    def flush(self):
+        """Barrier: returns once everything printed so far has been written."""
+        self.flush_frame()
+        if self.writer is not None:
+            with self.queue_ready:
+                while self.queue or self.writing:
+                    self.queue_ready.wait()
+            if self.writer_error is not None:
+                error, self.writer_error = self.writer_error, None
+                raise error
+
+    def stop_writer(self):
+        """Flushes and stops the writer thread; output is synchronous again."""
+        import atexit
+        if self.writer is None:
+            return
+        try:
+            self.flush()
+        finally:
+            with self.queue_ready:
+                self.writer_stop = True
+                self.queue_ready.notify_all()
+            self.writer.join()
+            self.writer = None
+            atexit.unregister(self.stop_writer)
+
     def print(self,*args,FG=None,BG=None,bold=False):
+        """Prints args separated by spaces in the given colors, followed by a newline, with one write."""
+        style = self.get_style(FG,BG,bold)
+        text = ' '.join([str(s) for s in args])
+        self.advance_cursor(text,newline=True)
         if self.os_type == 'Windows':
-            if not FG: FG = self.default_fc
-            if not BG: BG = self.default_bc
-            FG = str(FG).lower().strip()
-            BG = str(BG).lower().strip()
-            if bold:
-                self.set_text_color((self.win_fg['bold'] | self.win_fg[FG]) | self.win_bg[BG])
-            else:
-                self.set_text_color( self.win_fg[FG] | self.win_bg[BG])
-            ends = ' '
-            if len(args):
-                for x, s in enumerate(args):
-                    if x == len(args)-1: ends = ''
-                    print(s,end=ends,flush=True)
-            self.set_text_color(self.default_colors)
-            print('')
-        else: # Linux, Darwin 
-            if not FG:
-                FG = 'default'
-            else:
-                FG = str(FG).lower().strip()
-                if not FG in self.ansi_fg: FG = 'default'
-            if not BG:
-                BG = 'default'
-            else:
-                BG = str(BG).lower().strip()
-                if not BG in self.ansi_bg: BG = 'default'
-            if bold:
-                print(self.esc+self.attrib['bold'].strip('m')+';'+self.ansi_fg[FG].strip('m')+';'+self.ansi_bg[BG],end='',flush=True)
-            else:
-                print(self.esc+str(self.ansi_fg[FG]).strip('m')+';'+str(self.ansi_bg[BG]),end='',flush=True)
-            ends = ' '
-            if len(args):
-                for x, s in enumerate(args):
-                    if x == len(args)-1: ends = ''
-                    print(s,end=ends,flush=True)
-            self.set_text_color(self.default_colors)
-            print(self.end)
+            self.segments.append((style,text))
+            self.write('\n')
+        else: # Linux, Darwin
+            self.write(style+text+self.end+'\n')
             
     def printxy(self,x,y,*args,FG=None,BG=None,bold=False):
-        self.gotoxy(x,y)
-        self.print(*args,FG=FG,BG=BG,bold=bold)
+        with self.frame(key=(x,y)):
+            self.gotoxy(x,y)
+            self.print(*args,FG=FG,BG=BG,bold=bold)
 # End class TermColorText()
 
+class TermScreen():
+    """Double-buffered screen on top of a TermColorText. Draw anywhere into the
+    off-screen cell buffer (character and style per cell) with put(), printxy(),
+    fill() and clear(), then refresh() writes only the cells that changed since
+    the last refresh: styled runs with as few cursor moves as possible, in one
+    frame (one write on ANSI terminals, one per style run on Windows)."""
+
+    GAP = 6 # Unchanged cells rewritten rather than jumped over with a cursor move (~7 bytes)
+
+    def __init__(self,tct,width=None,height=None):
+        self.tct = tct
+        self.follow_size = width is None and height is None # Track the terminal size in refresh()
+        self.chars = []
+        self.attrs = []
+        size = tct.get_visual_screen_size()
+        self.resize(width or size[0],height or size[1])
+
+    def resize(self,width,height):
+        """Sets a new screen size, keeping the buffer's top left contents. The next refresh() redraws everything."""
+        width = max(1,width)
+        height = max(1,height)
+        self.blank = self.tct.get_style()
+        chars = [[' ']*width for y in range(height)]
+        attrs = [[self.blank]*width for y in range(height)]
+        for y in range(min(height,len(self.chars))):
+            keep = min(width,len(self.chars[y]))
+            chars[y][:keep] = self.chars[y][:keep]
+            attrs[y][:keep] = self.attrs[y][:keep]
+        self.width = width
+        self.height = height
+        self.chars = chars
+        self.attrs = attrs
+        self.invalidate()
+
+    def invalidate(self):
+        """Forgets what the terminal shows, so the next refresh() clears the screen and redraws all cells."""
+        self.full = True
+
+    def put(self,x,y,text,FG=None,BG=None,bold=False):
+        """Draws "text" at column x, row y (1-based) into the buffer, clipped to the screen.
+        Returns the column after the text."""
+        x -= 1
+        y -= 1
+        text = str(text)
+        if x < 0:
+            text = text[-x:]
+            x = 0
+        text = text[:self.width-x]
+        if 0 <= y < self.height and text:
+            self.chars[y][x:x+len(text)] = text
+            self.attrs[y][x:x+len(text)] = [self.tct.get_style(FG,BG,bold)]*len(text)
+        return x+len(text)+1
+
+    def printxy(self,x,y,*args,FG=None,BG=None,bold=False):
+        """Like TermColorText.printxy(), but into the buffer."""
+        return self.put(x,y,' '.join([str(s) for s in args]),FG=FG,BG=BG,bold=bold)
+
+    def fill(self,x,y,width,height,char=' ',FG=None,BG=None,bold=False):
+        """Fills a rectangle of the buffer with "char"."""
+        for row in range(y,y+height):
+            self.put(x,row,char*width,FG=FG,BG=BG,bold=bold)
+
+    def clear(self,BG=None):
+        """Blanks the whole buffer."""
+        blank = self.tct.get_style(None,BG)
+        for y in range(self.height):
+            self.chars[y][:] = ' '*self.width
+            self.attrs[y][:] = [blank]*self.width
+
+    def refresh(self):
+        """Writes the changed cells to the terminal. A screen created without a size
+        follows the terminal: after a resize it is redrawn at the new size."""
+        tct = self.tct
+        windows = tct.os_type == 'Windows'
+        if self.follow_size:
+            size = tct.get_visual_screen_size()
+            if size != (self.width,self.height) and size[0] and size[1]:
+                self.resize(*size)
+        with tct.frame():
+            cx = cy = -1
+            if self.full:
+                tct.clear_screen()
+                cx = cy = 0 # Cursor is home after clearing
+                self.shown_chars = [[' ']*self.width for y in range(self.height)]
+                self.shown_attrs = [[self.blank]*self.width for y in range(self.height)]
+                self.full = False
+            current = None
+            for y in range(self.height):
+                chars, attrs = self.chars[y], self.attrs[y]
+                shown_chars, shown_attrs = self.shown_chars[y], self.shown_attrs[y]
+                if chars == shown_chars and attrs == shown_attrs:
+                    continue
+                width = self.width
+                if windows and y == self.height-1:
+                    width -= 1 # Writing the last cell would scroll the console
+                x = 0
+                while x < width:
+                    if chars[x] == shown_chars[x] and attrs[x] == shown_attrs[x]:
+                        x += 1
+                        continue
+                    end = last = x
+                    while end < width and end-last <= self.GAP:
+                        if chars[end] != shown_chars[end] or attrs[end] != shown_attrs[end]:
+                            last = end
+                        end += 1
+                    end = last+1
+                    if cx != x or cy != y:
+                        tct.gotoxy(x+1,y+1)
+                    while x < end:
+                        attr = attrs[x]
+                        stop = x+1
+                        while stop < end and attrs[stop] == attr:
+                            stop += 1
+                        text = ''.join(chars[x:stop])
+                        if windows:
+                            tct.write(text,attr)
+                        elif attr != current:
+                            tct.write(attr+text)
+                            current = attr
+                        else:
+                            tct.write(text)
+                        x = stop
+                    cx, cy = end, y
+                self.shown_chars[y] = list(chars)
+                self.shown_attrs[y] = list(attrs)
+            if current is not None:
+                tct.write(tct.end)
+            if cx >= 0:
+                tct.cursor_x, tct.cursor_y = cx+1, cy+1
+
+class TermTable():
+    """Table of rows drawn at (x, y) on a TermColorText, with a header line and
+    virtual scrolling: only the rows inside the view are formatted, and render()
+    rewrites only the screen lines whose text changed. Cells may contain ANSI
+    escape sequences and wide (East Asian) characters; widths are measured in
+    visible columns and cached per cell value.
+
+    columns is a list of titles or (title, width, align) tuples, align '<' or '>'.
+    Columns without a width grow to fit the widest cell seen so far."""
+
+    ESCAPE = r'\x1b\[[0-9;?]*[ -/]*[@-~]' # CSI sequence, e.g. SGR colors
+    MAX_CACHED = 65536 # Cell widths cached before the cache is cleared
+
+    def __init__(self,tct,columns,x=1,y=1,width=None,height=None,sep=' ',header=True,FG=None,BG=None,bold=True):
+        import re
+        import unicodedata
+        self.unicodedata = unicodedata
+        self.escape = re.compile(self.ESCAPE)
+        self.escape_split = re.compile('('+self.ESCAPE+')')
+        self.tct = tct
+        self.x = x
+        self.y = y
+        self.view_width = width # None: up to the right edge of the terminal
+        self.view_height = height # None: down to the bottom of the terminal
+        self.sep = sep
+        self.header = header
+        self.header_style = (FG,BG,bold)
+        self.cell_widths = {} # Cell text -> visible width
+        self.titles = []
+        self.align = []
+        self.fixed = []
+        self.widths = []
+        for column in columns:
+            column = (column,) if isinstance(column,str) else tuple(column)
+            self.titles.append(str(column[0]))
+            self.fixed.append(column[1] if len(column) > 1 and column[1] else None)
+            self.align.append(column[2] if len(column) > 2 else '<')
+            self.widths.append(self.fixed[-1] or self.visible_width(self.titles[-1]))
+        self.rows = [] # Tuples of cell strings
+        self.styles = [] # (FG, BG, bold) per row
+        self.lines = {} # Row index (-1: header) -> formatted line
+        self.shown = {} # Screen row -> line shown there
+        self.top = 0 # First row in the view
+
+    def char_width(self,char):
+        """Terminal columns used by one character: 0 (combining), 1 or 2 (wide)."""
+        if char < '\x7f':
+            return 1
+        if self.unicodedata.combining(char) or self.unicodedata.category(char) in ('Mn','Me','Cf'):
+            return 0
+        return 2 if self.unicodedata.east_asian_width(char) in ('W','F') else 1
+
+    def visible_width(self,text):
+        """Columns "text" takes on screen, ignoring escape sequences."""
+        width = self.cell_widths.get(text)
+        if width is None:
+            plain = self.escape.sub('',text) if '\x1b' in text else text
+            if plain.isascii():
+                width = len(plain)
+            else:
+                width = sum([self.char_width(char) for char in plain])
+            if len(self.cell_widths) >= self.MAX_CACHED:
+                self.cell_widths.clear()
+            self.cell_widths[text] = width
+        return width
+
+    def fit(self,text,width,align='<'):
+        """Pads or cuts "text" to exactly "width" visible columns, keeping escape sequences."""
+        used = self.visible_width(text)
+        if used <= width:
+            pad = ' '*(width-used)
+            return pad+text if align == '>' else text+pad
+        out = []
+        used = 0
+        for n, part in enumerate(self.escape_split.split(text)):
+            if n % 2:
+                out.append(part) # Escape sequence
+                continue
+            for char in part:
+                char_width = self.char_width(char)
+                if used+char_width > width:
+                    break
+                out.append(char)
+                used += char_width
+        return ''.join(out)+' '*(width-used)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def set_row(self,index,cells,FG=None,BG=None,bold=False):
+        """Sets row "index" (appends when index == len(table)). Unchanged rows cost one comparison."""
+        cells = tuple([str(cell) for cell in cells])
+        style = (FG,BG,bold)
+        if index == len(self.rows):
+            self.rows.append(cells)
+            self.styles.append(style)
+        elif self.rows[index] == cells and self.styles[index] == style:
+            return
+        else:
+            self.rows[index] = cells
+            self.styles[index] = style
+            self.lines.pop(index,None)
+        grown = False
+        for column, text in enumerate(cells[:len(self.widths)]):
+            if not self.fixed[column]:
+                width = self.visible_width(text)
+                if width > self.widths[column]:
+                    self.widths[column] = width
+                    grown = True
+        if grown:
+            self.lines.clear() # Every line is laid out again
+
+    def append(self,cells,FG=None,BG=None,bold=False):
+        self.set_row(len(self.rows),cells,FG=FG,BG=BG,bold=bold)
+
+    def set_rows(self,rows):
+        """Replaces all rows; rows equal to the current ones are not formatted again."""
+        count = 0
+        for index, cells in enumerate(rows):
+            self.set_row(index,cells)
+            count = index+1
+        if count < len(self.rows):
+            del self.rows[count:]
+            del self.styles[count:]
+            self.lines = {index: line for index, line in self.lines.items() if index < count}
+
+    def view(self):
+        """Returns the (columns, rows) of the view, including the header line."""
+        cols, rows = self.tct.get_visual_screen_size()
+        width = min(self.view_width or cols,cols-self.x+1)
+        if self.tct.os_type == 'Windows':
+            width -= 1 # Writing the last column can scroll the console
+        height = min(self.view_height or rows,rows-self.y+1)
+        return max(0,width), max(0,height)
+
+    def body_height(self):
+        return max(0,self.view()[1]-(1 if self.header else 0))
+
+    def scroll(self,rows):
+        """Scrolls the view by "rows" (negative: up)."""
+        self.scroll_to(self.top+rows)
+
+    def scroll_to(self,index):
+        """Scrolls so row "index" is the first row in the view."""
+        self.top = max(0,min(index,len(self.rows)-self.body_height()))
+
+    def format_row(self,cells,style):
+        """Lays out one line: fitted cells joined by the separator, in the row's style."""
+        windows = self.tct.os_type == 'Windows'
+        prefix = '' if windows else self.tct.get_style(*style)
+        fields = []
+        for column, width in enumerate(self.widths):
+            text = cells[column] if column < len(cells) else ''
+            if '\x1b' in text:
+                if windows:
+                    text = self.escape.sub('',text)
+                else: # The cell sets its own colors; restore the row style after it
+                    fields.append(self.fit(text,width,self.align[column])+prefix)
+                    continue
+            fields.append(self.fit(text,width,self.align[column]))
+        return prefix+self.fit(self.sep.join(fields),self.line_width)
+
+    def invalidate(self):
+        """Forgets what the terminal shows, so the next render() draws every line."""
+        self.shown.clear()
+
+    def render(self):
+        """Draws the view: header plus the rows from self.top, only lines that changed."""
+        tct = self.tct
+        width, height = self.view()
+        if width != getattr(self,'line_width',None):
+            self.line_width = width
+            self.lines.clear()
+        self.scroll_to(self.top) # Clamp after rows were removed or the view shrank
+        windows = tct.os_type == 'Windows'
+        end = '' if windows else tct.end
+        blank = ' '*width
+        if len(self.lines) > 4*height+64: # Drop lines scrolled out of view
+            self.lines = {index: line for index, line in self.lines.items() if index < 0 or self.top <= index < self.top+height}
+        with tct.frame(key=('table',id(self))):
+            screen_y = self.y
+            index = self.top
+            for n in range(height):
+                if self.header and not n:
+                    row = -1
+                    style = self.header_style
+                elif index < len(self.rows):
+                    row = index
+                    style = self.styles[index]
+                    index += 1
+                else:
+                    row = None
+                    style = (None,None,False)
+                if row is None:
+                    line = blank
+                else:
+                    line = self.lines.get(row)
+                    if line is None:
+                        line = self.format_row(self.titles if row < 0 else self.rows[row],style)
+                        self.lines[row] = line
+                if self.shown.get(screen_y) != (line,style):
+                    tct.gotoxy(self.x,screen_y)
+                    tct.write(line+end,tct.get_style(*style) if windows else None)
+                    self.shown[screen_y] = (line,style)
+                    tct.cursor_x = self.x+width
+                screen_y += 1
+
 def test():
     from time import sleep
     